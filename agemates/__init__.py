@@ -0,0 +1 @@
+"""Data and story building blocks shared by the My Age-Mates app."""
@@ -0,0 +1,190 @@
+"""Population totals behind the story headlines, precomputed once per dataset.
+
+Every headline number of the story is a population sum over one of a handful
+of groupings, so they are all grouped up front and answered as dict lookups
+instead of boolean masks over the whole frame on every click.
+``cohort_statistics`` answers them for many selections at once, with index
+lookups over the grouped totals instead of a loop. For a dataset from
+``agemates.build`` the totals are read from the aggregate tables of the build,
+when their checksums match its manifest, instead of being grouped again.
+"""
+import io
+
+import numpy as np
+import pandas as pd
+
+from agemates.data import DATA_CSV, HAVE_PYARROW, load_derived
+from agemates.schema import load_schema
+
+
+# Groupings of the cube: name of the aggregate table agemates.build writes -> grouping columns
+AGGREGATE_TABLES = {
+    'year_country_gender': ('Year', 'Country', 'Gender'),
+    'year_country': ('Year', 'Country'),
+    'year_subregion': ('Year', 'Subregion'),
+    'year_continent': ('Year', 'Continent'),
+    'year': ('Year',),
+    'generation': ('Generation',),
+}
+
+
+class PopulationCube:
+    """Population totals by Year×Country×Gender, Year×Country, Year×Subregion,
+    Year×Continent, Year, Generation and overall."""
+
+    def __init__(self, df):
+        population = df['Population'].astype('int64')
+        self._index({
+            columns: population.groupby([df[column] for column in columns], observed=True).sum()
+            for columns in AGGREGATE_TABLES.values()
+        })
+
+    @classmethod
+    def from_tables(cls, tables):
+        """Return the cube of ``{table name: frame of its grouping columns and Population}``."""
+        cube = cls.__new__(cls)
+        cube._index({
+            columns: tables[name].set_index(list(columns))['Population'].astype('int64')
+            for name, columns in AGGREGATE_TABLES.items()
+        })
+        return cube
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        """Return the cube from the verified aggregate tables of the snapshot's build, else grouped from its frame."""
+        if not HAVE_PYARROW:
+            return cls(snapshot.df)
+        tables = {}
+        for name in AGGREGATE_TABLES:
+            content = snapshot.read_built(f'aggregates/{name}.parquet')
+            if content is None:
+                return cls(snapshot.df)
+            tables[name] = pd.read_parquet(io.BytesIO(content))
+        return cls.from_tables(tables)
+
+    def _index(self, tables):
+        # The grouped totals as Series too, for batch lookups
+        self.tables = tables
+
+        def totals(*columns):
+            return {key: int(value) for key, value in tables[columns].items()}
+
+        self._year_country_gender = totals('Year', 'Country', 'Gender')
+        self._year_country = totals('Year', 'Country')
+        self._year_subregion = totals('Year', 'Subregion')
+        self._year_continent = totals('Year', 'Continent')
+        self._year = totals('Year')
+        self._generation = totals('Generation')
+        self._total = int(tables[('Year',)].sum())
+
+    def year_country_gender(self, year, country, gender):
+        return self._year_country_gender.get((year, country, gender), 0)
+
+    def year_country(self, year, country):
+        return self._year_country.get((year, country), 0)
+
+    def year_subregion(self, year, subregion):
+        return self._year_subregion.get((year, subregion), 0)
+
+    def year_continent(self, year, continent):
+        return self._year_continent.get((year, continent), 0)
+
+    def year(self, year):
+        return self._year.get(year, 0)
+
+    def generation(self, generation):
+        return self._generation.get(generation, 0)
+
+    def total(self):
+        return self._total
+
+
+def mask_totals(df, year, country, gender, subregion, continent, generation):
+    """Compute the cube's answers for one selection with the original boolean masks.
+
+    This is the reference the cube is checked against, it is not meant for the hot path.
+    """
+    return [
+        df[(df['Year'] == year) & (df['Country'] == country) & (df['Gender'] == gender)]['Population'].sum(),
+        df[(df['Year'] == year) & (df['Country'] == country)]['Population'].sum(),
+        df[(df['Subregion'] == subregion) & (df['Year'] == year)]['Population'].sum(),
+        df[(df['Continent'] == continent) & (df['Year'] == year)]['Population'].sum(),
+        df[(df['Year'] == year)]['Population'].sum(),
+        df[(df['Generation'] == generation)]['Population'].sum(),
+        df['Population'].sum(),
+    ]
+
+
+def check_cube(df, cube, selections):
+    """Return the selections whose cube answers differ from ``mask_totals``.
+
+    ``selections`` is an iterable of (year, country, gender, subregion, continent, generation).
+    """
+    mismatches = []
+    for year, country, gender, subregion, continent, generation in selections:
+        expected = mask_totals(df, year, country, gender, subregion, continent, generation)
+        actual = [
+            cube.year_country_gender(year, country, gender),
+            cube.year_country(year, country),
+            cube.year_subregion(year, subregion),
+            cube.year_continent(year, continent),
+            cube.year(year),
+            cube.generation(generation),
+            cube.total(),
+        ]
+        if actual != [int(value) for value in expected]:
+            mismatches.append((year, country, gender))
+    return mismatches
+
+
+# Columns of cohort_statistics: (column, grouping of the cube, lookup columns)
+STATISTICS = [
+    ('cohort', ('Year', 'Country', 'Gender'), ['year', 'country', 'gender']),
+    ('country_year', ('Year', 'Country'), ['year', 'country']),
+    ('subregion_year', ('Year', 'Subregion'), ['year', 'subregion']),
+    ('continent_year', ('Year', 'Continent'), ['year', 'continent']),
+    ('world_year', ('Year',), ['year']),
+    ('generation_total', ('Generation',), ['generation']),
+]
+
+
+def cohort_statistics(years, countries, genders, csv_path=DATA_CSV):
+    """Return the headline numbers of many selections at once, one row per (year, country, gender).
+
+    Besides the selection, its ISO3 code, subregion, continent and generation, the
+    columns are the population of the cohort (``cohort``), of the country, subregion,
+    continent and world in that year, of the generation, everyone (``total``) and the
+    shares ``generation_share`` (generation / total) and ``age_mate_share``
+    (world year / total). Unknown selections get 0 totals and missing metadata.
+    """
+    cube = load_cube(csv_path)
+    schema = load_schema(csv_path)
+    stats = pd.DataFrame({
+        'year': np.asarray(years, dtype='int64'),
+        'country': np.asarray(countries, dtype=object),
+        'gender': np.asarray(genders, dtype=object),
+    })
+    country_index = pd.Index(schema.countries['Country'])
+    positions = country_index.get_indexer(stats['country'])
+    for column in ['ISO3_code', 'Subregion', 'Continent']:
+        values = schema.countries[column].to_numpy(dtype=object)
+        stats[column.lower()] = np.where(positions >= 0, values[positions], None)
+    stats = stats.rename(columns={'iso3_code': 'iso3'})
+    stats['generation'] = stats['year'].map(schema.generation_by_year())
+
+    for column, grouping, keys in STATISTICS:
+        table = cube.tables[grouping]
+        if len(keys) == 1:
+            index = pd.Index(stats[keys[0]])
+        else:
+            index = pd.MultiIndex.from_arrays([stats[key] for key in keys])
+        stats[column] = table.reindex(index).fillna(0).to_numpy(dtype='int64')
+    stats['total'] = cube.total()
+    stats['generation_share'] = stats['generation_total'] / stats['total']
+    stats['age_mate_share'] = stats['world_year'] / stats['total']
+    return stats
+
+
+def load_cube(csv_path=DATA_CSV):
+    """Return the shared cube for the dataset at ``csv_path``, loading or building it on first use."""
+    return load_derived(PopulationCube, csv_path)
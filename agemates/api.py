@@ -0,0 +1,182 @@
+"""Headless ASGI API serving the stories without a Streamlit session.
+
+``GET /story?year=1980&country=Hungary&gender=Female`` returns the same story
+HTML the app shows, ``&format=json`` the JSON slide spec of ``build_spec``.
+Stories come from the process-wide story cache over the shared read-only
+dataset. The ETag is the digest of the key the story is cached under, which
+also covers where its data is published, so conditional requests are answered
+with 304 without building anything. Building runs in worker threads, the
+event loop only moves bytes.
+
+The story backgrounds are loaded from the relative ``app/static/`` URL, like
+in the app, so the API serves that directory too (see ``agemates.assets``).
+
+Serve it with any ASGI server, e.g. ``uvicorn story_api:app``, or call it in
+process with ``request``.
+"""
+import asyncio
+import mimetypes
+import os
+from urllib.parse import parse_qs
+
+from agemates.aggregates import load_cube
+from agemates.assets import CACHE_CONTROL as STATIC_CACHE_CONTROL
+from agemates.assets import STATIC_DIR, STATIC_URL, background_urls
+from agemates.cache import StoryCache
+from agemates.data import DATA_CSV, pinned
+from agemates.payload import load_story_data
+from agemates.schema import load_schema
+from agemates.story import HEIGHT, WIDTH, cached_spec, cached_story, spec_key, story_cache_key
+
+# Stories change only with the data or code, which the ETag covers, so clients always revalidate
+CACHE_CONTROL = 'no-cache'
+
+# Where the stories load the published backgrounds from, relative to /story
+STATIC_PATH = f'/{STATIC_URL}/'
+
+FORMATS = {
+    'html': ('text/html; charset=utf-8', story_cache_key, cached_story),
+    'json': ('application/json', spec_key, cached_spec),
+}
+
+
+class BadRequest(ValueError):
+    pass
+
+
+def parse_selection(query, csv_path=DATA_CSV):
+    """Return (year, country, gender, format) of a query string, raising ``BadRequest`` when invalid."""
+    params = {name: values[-1] for name, values in parse_qs(query).items()}
+    schema = load_schema(csv_path)
+    try:
+        year = int(params.get('year', ''))
+    except ValueError:
+        raise BadRequest('year must be an integer') from None
+    years = schema.years()
+    if year not in years:
+        raise BadRequest(f'year must be between {years.start} and {years.stop - 1}')
+    country = params.get('country')
+    if not schema.has_country(country):
+        raise BadRequest('unknown country')
+    gender = params.get('gender')
+    if not schema.has_gender(gender):
+        raise BadRequest('unknown gender')
+    story_format = params.get('format', 'html')
+    if story_format not in FORMATS:
+        raise BadRequest('format must be html or json')
+    return year, country, gender, story_format
+
+
+def _etag_matches(if_none_match, etag):
+    if if_none_match is None:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in tags or any(tag.removeprefix('W/') == etag for tag in tags)
+
+
+def story_response(query, if_none_match=None, csv_path=DATA_CSV, with_body=True):
+    """Return (status, headers, body) of a story request; blocks while the story is built."""
+    # Validation, ETag and story all come from the same version of the dataset
+    with pinned(csv_path):
+        try:
+            year, country, gender, story_format = parse_selection(query, csv_path)
+        except BadRequest as error:
+            return 400, [('content-type', 'text/plain; charset=utf-8')], str(error).encode()
+        content_type, key, cached = FORMATS[story_format]
+        etag = '"%s"' % StoryCache.digest(key(year, country, gender, csv_path))
+        headers = [('etag', etag), ('cache-control', CACHE_CONTROL)]
+        if _etag_matches(if_none_match, etag):
+            return 304, headers, b''
+        body = cached(year, country, gender, csv_path)
+    headers += [('content-type', content_type), ('content-length', str(len(body)))]
+    return 200, headers, body if with_body else b''
+
+
+def static_response(name, with_body=True):
+    """Return (status, headers, body) of a file below ``STATIC_DIR``; its paths are versioned."""
+    path = os.path.normpath(os.path.join(STATIC_DIR, name))
+    if not path.startswith(STATIC_DIR + os.sep) or not os.path.isfile(path):
+        return 404, [('content-type', 'text/plain; charset=utf-8')], b'not found'
+    with open(path, 'rb') as file:
+        body = file.read()
+    headers = [
+        ('content-type', mimetypes.guess_type(path)[0] or 'application/octet-stream'),
+        ('content-length', str(len(body))),
+        ('cache-control', STATIC_CACHE_CONTROL),
+    ]
+    return 200, headers, body if with_body else b''
+
+
+def create_app(csv_path=DATA_CSV):
+    """Return the ASGI application serving the stories of the dataset at ``csv_path``."""
+
+    async def app(scope, receive, send):
+        if scope['type'] == 'lifespan':
+            while True:
+                message = await receive()
+                if message['type'] == 'lifespan.startup':
+                    # Parse the dataset and build the lookup structures before the first request
+                    await asyncio.to_thread(load_story_data, csv_path)
+                    await asyncio.to_thread(load_cube, csv_path)
+                    await asyncio.to_thread(background_urls, WIDTH, HEIGHT)
+                    await send({'type': 'lifespan.startup.complete'})
+                elif message['type'] == 'lifespan.shutdown':
+                    await send({'type': 'lifespan.shutdown.complete'})
+                    return
+        if scope['type'] != 'http':
+            return
+
+        path = scope['path']
+        if path != '/story' and not path.startswith(STATIC_PATH):
+            status, headers, body = 404, [('content-type', 'text/plain; charset=utf-8')], b'not found'
+        elif scope['method'] not in ('GET', 'HEAD'):
+            status, headers, body = 405, [('allow', 'GET, HEAD')], b''
+        elif path != '/story':
+            status, headers, body = await asyncio.to_thread(
+                static_response, path[len(STATIC_PATH):], scope['method'] == 'GET')
+        else:
+            request_headers = dict(scope['headers'])
+            if_none_match = request_headers.get(b'if-none-match')
+            status, headers, body = await asyncio.to_thread(
+                story_response,
+                scope['query_string'].decode('latin-1'),
+                if_none_match.decode('latin-1') if if_none_match is not None else None,
+                csv_path,
+                scope['method'] == 'GET',
+            )
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(name.encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+    return app
+
+
+async def request(app, path, method='GET', headers=()):
+    """Call ``app`` in process and return (status, {header: value}, body)."""
+    path, _, query = path.partition('?')
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': method,
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode(),
+        'query_string': query.encode(),
+        'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+    }
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    await app(scope, receive, send)
+    start, *bodies = messages
+    response_headers = {name.decode('latin-1'): value.decode('latin-1') for name, value in start['headers']}
+    return start['status'], response_headers, b''.join(message.get('body', b'') for message in bodies)
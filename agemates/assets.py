@@ -0,0 +1,234 @@
+"""Publishing of the story data and backgrounds as static, browser-cacheable assets.
+
+Everything in the story data except a 75-row head only depends on the birth
+year (see ``agemates.payload``). With ``AGEMATES_ASSET_SERVER=host:port`` the
+year frames are written once per dataset and code version as precompressed
+JSON files under a versioned path, served by a small threaded HTTP server with
+immutable cache headers. The story HTML then embeds only the head and fetches
+the year frame by URL, so browsers download each year at most once. The
+resized slide backgrounds are published and served the same way, or without
+an asset server from Streamlit's static directory; only the self-contained
+export embeds them. ``AGEMATES_ASSET_URL`` overrides the public base URL, e.g.
+behind a proxy.
+"""
+import functools
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import threading
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from agemates.backgrounds import SCALES, SLIDE_BACKGROUNDS, background_fingerprint, variant, variant_name
+from agemates.cache import CODE_FINGERPRINT, atomic_write
+from agemates.data import BASE_DIR, DATA_CSV, dataset_fingerprint, load_dataset
+from agemates.payload import load_story_data, vizzu_data, with_year2
+
+try:
+    import brotli
+except ImportError:  # brotli variants are optional, gzip is always written
+    brotli = None
+
+ASSET_DIR = os.path.join(BASE_DIR, '.assets')
+
+# Streamlit's static file serving (see .streamlit/config.toml) of the directory next to the app;
+# relative, so that it resolves against the page (the story iframes are srcdoc documents) or /story
+STATIC_DIR = os.path.join(BASE_DIR, 'static')
+STATIC_URL = 'app/static'
+
+# Assets are versioned by path, so they can be cached forever
+CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+# Precompressed variants in order of preference: (Content-Encoding, file suffix)
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+
+def asset_version(csv_path=DATA_CSV):
+    """Return the version the assets of the dataset at ``csv_path`` are published under."""
+    return hashlib.sha256(f'{dataset_fingerprint(csv_path)} {CODE_FINGERPRINT}'.encode()).hexdigest()[:16]
+
+
+def year_asset_name(year):
+    return f'year-{int(year)}.json'
+
+
+def publish_year_frames(directory=ASSET_DIR, csv_path=DATA_CSV):
+    """Write the year frames of the dataset below ``directory`` unless already there.
+
+    Returns the version directory name.
+    """
+    version = asset_version(csv_path)
+    target = os.path.join(directory, version)
+    story_data = load_story_data(csv_path)
+    for year in sorted(load_dataset(csv_path)['Year'].unique()):
+        path = os.path.join(target, year_asset_name(year))
+        if os.path.exists(path + '.gz'):
+            continue
+        data = vizzu_data(with_year2(story_data.year_frame(year)))
+        _write_compressed(path, json.dumps(data, separators=(',', ':')).encode())
+    return version
+
+
+def _write_compressed(path, raw):
+    if brotli is not None:
+        atomic_write(path + '.br', brotli.compress(raw))
+    atomic_write(path, raw)
+    # The .gz variant is written last, it marks the file as published
+    atomic_write(path + '.gz', gzip.compress(raw, mtime=0))
+
+
+def publish_backgrounds(width, height, directory=ASSET_DIR):
+    """Write the background variants for a ``width``×``height`` player below ``directory``.
+
+    Returns the version directory name.
+    """
+    version = 'backgrounds-' + background_fingerprint()[:16]
+    for path in set(SLIDE_BACKGROUNDS.values()):
+        for scale in SCALES:
+            target = os.path.join(directory, version, variant_name(path, width, height, scale))
+            if not os.path.exists(target):
+                # WebP is already compressed, there are no precompressed variants
+                atomic_write(target, variant(path, width, height, scale))
+    return version
+
+
+class AssetRequestHandler(BaseHTTPRequestHandler):
+    """Serves the published files with their best precompressed variant."""
+
+    directory = ASSET_DIR
+
+    def do_GET(self):
+        path = os.path.normpath(os.path.join(self.directory, self.path.split('?')[0].lstrip('/')))
+        if not path.startswith(os.path.abspath(self.directory) + os.sep) or not os.path.isfile(path):
+            self.send_error(404)
+            return
+        accepted = self.headers.get('Accept-Encoding', '')
+        encoding, suffix = next(
+            ((encoding, suffix) for encoding, suffix in ENCODINGS
+             if encoding in accepted and os.path.isfile(path + suffix)),
+            (None, ''),
+        )
+        etag = '"%s%s"' % (os.path.relpath(path, self.directory).replace(os.sep, '/'), suffix)
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self._send_cache_headers(etag)
+            self.end_headers()
+            return
+        with open(path + suffix, 'rb') as file:
+            body = file.read()
+        self.send_response(200)
+        self.send_header('Content-Type', mimetypes.guess_type(path)[0] or 'application/octet-stream')
+        self.send_header('Content-Length', str(len(body)))
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        self._send_cache_headers(etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_cache_headers(self, etag):
+        self.send_header('Cache-Control', CACHE_CONTROL)
+        self.send_header('ETag', etag)
+        self.send_header('Vary', 'Accept-Encoding')
+        # The story runs in a srcdoc iframe, whose origin is opaque
+        self.send_header('Access-Control-Allow-Origin', '*')
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_asset_server(directory=ASSET_DIR, host='127.0.0.1', port=0):
+    """Serve ``directory`` from a daemon thread and return the server."""
+    handler = type('BoundAssetRequestHandler', (AssetRequestHandler,), {'directory': os.path.abspath(directory)})
+    server = ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, name='agemates-assets', daemon=True).start()
+    return server
+
+
+_lock = threading.Lock()
+_server = None
+_versions = {}
+
+
+def _published(key, publish):
+    # Starts the server and publishes on first use, returns (base URL, version) or (None, None);
+    # concurrent first calls with the same key wait for one publish
+    global _server
+    address = os.environ.get('AGEMATES_ASSET_SERVER')
+    if not address:
+        return None, None
+    host, port = address.rsplit(':', 1)
+    with _lock:
+        if _server is None:
+            _server = start_asset_server(ASSET_DIR, host, int(port))
+        future = _versions.get(key)
+        owner = future is None
+        if owner:
+            future = _versions[key] = Future()
+    if owner:
+        # Published outside the lock, so that other keys, and callers whose key is published, do not wait for it
+        try:
+            future.set_result(publish())
+        except BaseException as error:
+            future.set_exception(error)
+            # Retried by the next call
+            with _lock:
+                del _versions[key]
+            raise
+    version = future.result()
+    base_url = os.environ.get('AGEMATES_ASSET_URL') or f'http://{address}'
+    return base_url.rstrip('/'), version
+
+
+def year_asset_url(year, csv_path=DATA_CSV):
+    """Return the URL of the year frame of ``year``, or None when assets are not enabled.
+
+    The first call publishes the assets and starts the server configured by
+    ``AGEMATES_ASSET_SERVER``.
+    """
+    csv_path = os.path.abspath(csv_path)
+    base_url, version = _published(
+        ('data', csv_path, dataset_fingerprint(csv_path)), lambda: publish_year_frames(ASSET_DIR, csv_path)
+    )
+    if base_url is None:
+        return None
+    return f'{base_url}/{version}/{year_asset_name(year)}'
+
+
+@functools.lru_cache(maxsize=None)
+def _static_backgrounds(width, height, fingerprint):
+    # Once per player size and background version, the files stay for the next process
+    return publish_backgrounds(width, height, STATIC_DIR)
+
+
+def background_urls(width, height):
+    """Return {slide: [1x URL, 2x URL, ...]} of the published backgrounds.
+
+    From the asset server when it is enabled, else from ``STATIC_DIR``, which
+    Streamlit and the story API both serve at the relative ``STATIC_URL``.
+    """
+    base_url, version = _published(
+        ('backgrounds', width, height, background_fingerprint()), lambda: publish_backgrounds(width, height)
+    )
+    if base_url is None:
+        base_url, version = STATIC_URL, _static_backgrounds(width, height, background_fingerprint())
+    return {
+        slide: [f'{base_url}/{version}/{variant_name(path, width, height, scale)}' for scale in SCALES]
+        for slide, path in SLIDE_BACKGROUNDS.items()
+    }
+
+
+def spec_asset_url(spec):
+    """Publish the JSON slide ``spec`` (bytes) of a progressive story, return its URL or None without assets.
+
+    Specs are stored by content hash, so a spec is written once however many stories share it.
+    """
+    base_url, version = _published(('specs',), lambda: 'specs')
+    if base_url is None:
+        return None
+    name = hashlib.sha256(spec).hexdigest()[:32] + '.json'
+    path = os.path.join(ASSET_DIR, version, name)
+    if not os.path.exists(path + '.gz'):
+        _write_compressed(path, spec)
+    return f'{base_url}/{version}/{name}'
@@ -0,0 +1,111 @@
+"""Background images of the story slides.
+
+The images are shipped with the app and resized once per process to the size
+of the story player (and twice that for high-density screens), so the
+``background-draw`` handler only blits a bitmap of the canvas size instead of
+scaling the full-size source on every frame. The player script fetches them
+with ``createImageBitmap``, which decodes off the main thread, and never
+delays the first render: a slide just gets its background once it is ready.
+"""
+import base64
+import functools
+import hashlib
+import io
+import json
+import os
+
+from PIL import Image
+
+from agemates.data import BASE_DIR
+
+STAIRCASE = os.path.join(BASE_DIR, '66a7736d61b51207bfff94e2_Vizzu-Team-Staircase-v2.webp')
+
+# Background image of each slide (0-based), slides without an entry have none
+SLIDE_BACKGROUNDS = {7: STAIRCASE}
+
+# Variants are generated for these device pixel ratios
+SCALES = (1, 2)
+
+WEBP_QUALITY = 70
+
+
+@functools.lru_cache(maxsize=None)
+def background_fingerprint():
+    """Return a hash of the slide layout and of the source images."""
+    digest = hashlib.sha256(json.dumps(sorted(SLIDE_BACKGROUNDS.items())).encode())
+    for path in sorted(set(SLIDE_BACKGROUNDS.values())):
+        digest.update(_source_bytes(path))
+    return digest.hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def _source_bytes(path):
+    with open(path, 'rb') as file:
+        return file.read()
+
+
+def variant_size(path, width, height, scale):
+    # Never upscale beyond the source image
+    source_width, _ = Image.open(io.BytesIO(_source_bytes(path))).size
+    factor = min(scale, source_width / width)
+    return round(width * factor), round(height * factor)
+
+
+def variant_name(path, width, height, scale):
+    stem = os.path.splitext(os.path.basename(path))[0]
+    variant_width, variant_height = variant_size(path, width, height, scale)
+    return f'{stem}-{variant_width}x{variant_height}.webp'
+
+
+@functools.lru_cache(maxsize=None)
+def variant(path, width, height, scale):
+    """Return ``path`` resized for a ``width``×``height`` player at ``scale``, as WebP bytes."""
+    image = Image.open(io.BytesIO(_source_bytes(path))).convert('RGB')
+    # Resized to the canvas aspect ratio, the handler draws it over the whole canvas anyway
+    image = image.resize(variant_size(path, width, height, scale), Image.LANCZOS)
+    output = io.BytesIO()
+    image.save(output, 'WEBP', quality=WEBP_QUALITY, method=6)
+    return output.getvalue()
+
+
+def inline_sources(width, height):
+    """Return the per-slide backgrounds as data URIs of the 1x variant, for self-contained stories."""
+    return {
+        slide: ['data:image/webp;base64,' + base64.b64encode(variant(path, width, height, 1)).decode()]
+        for slide, path in SLIDE_BACKGROUNDS.items()
+    }
+
+
+BACKGROUND_SCRIPT = """
+    <div><script type="module">
+    // Slide index -> background URLs by device pixel ratio (1x, 2x, ...)
+    const backgrounds = %s;
+
+    function loadBackground(urls) {
+        const url = urls[Math.min(urls.length, Math.ceil(window.devicePixelRatio || 1)) - 1];
+        // createImageBitmap decodes off the main thread
+        return fetch(url).then(response => response.blob()).then(blob => createImageBitmap(blob));
+    }
+
+    const vp = document.querySelector("vizzu-player");
+    window.storyBgImages = [];
+
+    vp.initializing.then(chart => {
+        vp.addEventListener('update', (e) => {
+        window.storyCurrentSlide = e.detail.currentSlide;
+        chart.feature.rendering.update();
+        });
+        for (const [slide, urls] of Object.entries(backgrounds)) {
+            loadBackground(urls).then(image => {
+                window.storyBgImages[slide] = image;
+                chart.feature.rendering.update();
+            });
+        }
+    })
+    </script></div>
+    """
+
+
+def background_script(sources):
+    """Return the player script that loads ``sources`` ({slide: [url, ...]}) as slide backgrounds."""
+    return BACKGROUND_SCRIPT % json.dumps({str(slide): urls for slide, urls in sorted(sources.items())})
@@ -0,0 +1,230 @@
+"""Offline build of the runtime data files from the raw population source.
+
+    python -m agemates.build --source raw/population.csv --out .
+
+The sources are CSV files with the columns Year, ISO3_code, Country,
+Subregion, Continent, Population and Gender (e.g. one file per gender or per
+region, concatenated in the given order, which is the order the app lists the
+countries in). The build validates them with vectorized checks, derives G_Type
+and Generation, and writes to ``--out``:
+
+* ``data.csv``: UTF-8, the columns of the app in order;
+* ``data.parquet`` and ``data.feather``: the typed dataset, see ``agemates.data``;
+* ``data.metadata.json``: what the input widgets show, see ``agemates.startup``;
+* ``aggregates/<table>.parquet``: the population totals behind the headlines,
+  which ``agemates.aggregates`` loads instead of grouping the dataset;
+* ``build-manifest.json``: the sha256 of every file above and of the sources.
+
+Any validation error aborts the build before anything is written, and the
+manifest is written last, so the app only ever uses files of a complete,
+verified build. The output only depends on the sources, so rebuilding
+reproduces it byte for byte with the same library versions.
+"""
+import argparse
+import io
+import json
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+from agemates.aggregates import AGGREGATE_TABLES
+from agemates.cache import atomic_write
+from agemates.data import BUILD_MANIFEST, COLUMNS, CSV_ENCODING, DTYPES, file_sha256, write_artifact
+from agemates.schema import get_generation
+from agemates.startup import Metadata, write_metadata
+
+SOURCE_COLUMNS = ['Year', 'ISO3_code', 'Country', 'Subregion', 'Continent', 'Population', 'Gender']
+
+G_TYPES = {'Male': 'Boys', 'Female': 'Girls'}
+
+class ValidationError(ValueError):
+    """The sources failed validation; ``problems`` lists every failed check."""
+
+    def __init__(self, problems):
+        super().__init__('\n'.join(problems))
+        self.problems = problems
+
+
+def read_sources(paths, encoding=CSV_ENCODING):
+    frames = [pd.read_csv(path, encoding=encoding, dtype={'ISO3_code': str}) for path in paths]
+    return pd.concat(frames, ignore_index=True)
+
+
+def _examples(values, limit=5):
+    values = list(dict.fromkeys(values))
+    return ', '.join(map(str, values[:limit])) + (', ...' if len(values) > limit else '')
+
+
+def validate(df):
+    """Raise ``ValidationError`` listing every problem of the concatenated sources."""
+    missing = [column for column in SOURCE_COLUMNS if column not in df.columns]
+    if missing:
+        raise ValidationError([f'missing columns: {", ".join(missing)}'])
+    problems = []
+
+    for column in ['Year', 'Population']:
+        values = pd.to_numeric(df[column], errors='coerce')
+        bad = values.isna() | (values != values.round())
+        if bad.any():
+            problems.append(f'{column}: {bad.sum()} rows are not integers, e.g. {_examples(df[column][bad])}')
+    if problems:
+        raise ValidationError(problems)
+
+    years = df['Year'].astype('int64')
+    population = df['Population'].astype('int64')
+    for column, values in [('Year', years), ('Population', population)]:
+        # Must fit the runtime dtypes (see agemates.data.DTYPES)
+        in_range = values.between(0, np.iinfo(DTYPES[column]).max)
+        if not in_range.all():
+            problems.append(f'{column} out of range: {_examples(values[~in_range])}')
+
+    for column in ['Country', 'Subregion', 'Continent', 'Gender']:
+        blank = df[column].isna() | (df[column].astype(str).str.strip() == '')
+        if blank.any():
+            problems.append(f'{column}: {blank.sum()} blank values')
+    unknown = ~df['Gender'].isin(list(G_TYPES))
+    if unknown.any():
+        problems.append(f'Gender: unknown values {_examples(df["Gender"][unknown])}')
+    iso3 = df['ISO3_code'].dropna()
+    malformed = ~iso3.str.fullmatch('[A-Z]{3}')
+    if malformed.any():
+        problems.append(f'ISO3_code: malformed codes {_examples(iso3[malformed])}')
+
+    duplicated = df.duplicated(['Year', 'Country', 'Gender'], keep=False)
+    if duplicated.any():
+        problems.append(f'{duplicated.sum()} rows duplicate a Year/Country/Gender, e.g. {_examples(df["Country"][duplicated])}')
+
+    # Every country has one row per year and gender
+    expected = years.nunique() * df['Gender'].nunique()
+    counts = df.groupby('Country', sort=False).size()
+    if (counts != expected).any():
+        problems.append(f'incomplete countries (expected {expected} rows): {_examples(counts.index[counts != expected])}')
+
+    # The country metadata is a function of the country
+    for column in ['ISO3_code', 'Subregion', 'Continent']:
+        ambiguous = df.groupby('Country', sort=False)[column].nunique(dropna=False) > 1
+        if ambiguous.any():
+            problems.append(f'{column} differs within countries: {_examples(ambiguous.index[ambiguous])}')
+
+    # Columns derived by the build must agree with what the source already has
+    derived = derive(df[SOURCE_COLUMNS].assign(Year=years, Population=population))
+    for column in ['G_Type', 'Generation']:
+        if column in df.columns:
+            differs = df[column].astype(str).to_numpy() != derived[column].astype(str).to_numpy()
+            if differs.any():
+                problems.append(f'{column}: {differs.sum()} rows differ from the derived values')
+
+    if problems:
+        raise ValidationError(problems)
+
+
+def derive(df):
+    """Return the sources with G_Type and Generation added, in the column order of the app."""
+    generations = {year: get_generation(year) for year in df['Year'].unique()}
+    return df.assign(
+        G_Type=df['Gender'].map(G_TYPES),
+        Generation=df['Year'].map(generations),
+    )[COLUMNS]
+
+
+def aggregate_tables(df):
+    """Return the ``agemates.aggregates.AGGREGATE_TABLES``, checked to add up to the grand total."""
+    total = int(df['Population'].astype('int64').sum())
+    tables = {}
+    for name, columns in AGGREGATE_TABLES.items():
+        table = (df.groupby(list(columns), observed=True, sort=True)['Population']
+                 .sum().astype('int64').reset_index())
+        if int(table['Population'].sum()) != total:
+            raise ValidationError([f'aggregate {name} does not add up to the total population'])
+        tables[name] = table
+    return tables
+
+
+def _write_artifact(df, path):
+    # Written through a temporary file, so that a reader never sees a partial artifact
+    tmp_path = path + '.tmp' + os.path.splitext(path)[1]
+    write_artifact(df, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def build(sources, out, encoding=CSV_ENCODING, log=print):
+    """Validate ``sources``, write the runtime files into ``out`` and return the manifest."""
+    df = read_sources(sources, encoding)
+    validate(df)
+    df = derive(df.assign(Year=df['Year'].astype('int64'), Population=df['Population'].astype('int64')))
+    tables = aggregate_tables(df)
+    log(f'{len(df)} rows, {df["Country"].nunique()} countries, years {df["Year"].min()}-{df["Year"].max()}')
+
+    buffer = io.StringIO()
+    df.to_csv(buffer, index=False, lineterminator='\n')
+    atomic_write(os.path.join(out, 'data.csv'), buffer.getvalue().encode('utf8'))
+    written = ['data.csv']
+    metadata = Metadata(df['Country'].unique().tolist(), df['Gender'].unique().tolist(),
+                        int(df['Year'].min()), int(df['Year'].max()))
+    write_metadata(os.path.join(out, 'data.csv'), metadata)
+    written.append('data.metadata.json')
+    typed = df.astype(DTYPES)
+    for name in ['data.parquet', 'data.feather']:
+        _write_artifact(typed, os.path.join(out, name))
+        written.append(name)
+    os.makedirs(os.path.join(out, 'aggregates'), exist_ok=True)
+    for name, table in tables.items():
+        path = os.path.join('aggregates', f'{name}.parquet')
+        _write_artifact(table, os.path.join(out, path))
+        written.append(path)
+
+    manifest = {
+        'encoding': 'utf-8',
+        'rows': len(df),
+        'sources': [{'name': os.path.basename(path), 'sha256': file_sha256(path)} for path in sources],
+        'files': {
+            name.replace(os.sep, '/'): {
+                'sha256': file_sha256(os.path.join(out, name)),
+                'bytes': os.path.getsize(os.path.join(out, name)),
+            }
+            for name in written
+        },
+    }
+    atomic_write(os.path.join(out, BUILD_MANIFEST), json.dumps(manifest, indent=2, sort_keys=True).encode())
+    for name, entry in manifest['files'].items():
+        log(f'{name}: {entry["bytes"]} bytes')
+    return manifest
+
+
+def verify(out):
+    """Return the files of the build in ``out`` whose checksum does not match its manifest."""
+    with open(os.path.join(out, BUILD_MANIFEST), encoding='utf8') as file:
+        manifest = json.load(file)
+    return [
+        name for name, entry in manifest['files'].items()
+        if not os.path.exists(os.path.join(out, name)) or file_sha256(os.path.join(out, name)) != entry['sha256']
+    ]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Build the My Age-Mates data files from the raw population source.')
+    parser.add_argument('--source', action='append', help='raw CSV file, repeat for several')
+    parser.add_argument('--out', required=True, help='output directory, e.g. . for the app')
+    parser.add_argument('--encoding', default=CSV_ENCODING, help='encoding of the sources (default: %(default)s)')
+    parser.add_argument('--verify', action='store_true', help='only check the checksums of an existing build')
+    args = parser.parse_args(argv)
+
+    if args.verify:
+        mismatched = verify(args.out)
+        for name in mismatched:
+            print(f'checksum mismatch: {name}', file=sys.stderr)
+        sys.exit(1 if mismatched else 0)
+    if not args.source:
+        parser.error('--source is required')
+    try:
+        build(args.source, args.out, args.encoding)
+    except ValidationError as error:
+        for problem in error.problems:
+            print(f'invalid source: {problem}', file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
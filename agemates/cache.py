@@ -0,0 +1,323 @@
+"""Cache of rendered story HTML shared by every session.
+
+The story only depends on (year, country, gender) and the dataset, so the
+rendered HTML is kept in a byte-bounded in-memory LRU tier backed by an
+on-disk tier that survives restarts. The disk tier has a byte budget of its
+own: stories of older data and code versions are never read again, so the
+least recently used files are deleted when it is exceeded. A failing disk
+(full, read-only, unreadable files) is logged and only costs the disk tier,
+never the story. Concurrent requests for the same key
+are collapsed so that the story is built only once. Stories rendered offline
+by ``agemates.prerender`` are read through ``PrerenderedStories``.
+"""
+import glob
+import gzip
+import hashlib
+import importlib.metadata
+import json
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+# Budget of the in-memory tier, a story is about 145 KB, its self-contained export about 215 KB
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+# Budget of the disk tier; when exceeded, the least recently used files are deleted down to
+# DISK_LOW_WATER of it, so that not every write has to scan the directory
+DEFAULT_MAX_DISK_BYTES = 1024 * 1024 * 1024
+DISK_LOW_WATER = 0.9
+
+logger = logging.getLogger(__name__)
+
+
+def _code_fingerprint():
+    # Rendered stories and published assets depend on this package and on the ipyvizzu versions,
+    # read from the installed metadata: importing ipyvizzu is left to the first story
+    versions = [importlib.metadata.version(name) for name in ('ipyvizzu', 'ipyvizzu-story')]
+    digest = hashlib.sha256(' '.join(versions).encode())
+    for path in sorted(glob.glob(os.path.join(os.path.dirname(__file__), '*.py'))):
+        with open(path, 'rb') as file:
+            digest.update(file.read())
+    return digest.hexdigest()
+
+
+CODE_FINGERPRINT = _code_fingerprint()
+
+# Layout of a pre-rendered story directory
+MANIFEST = 'manifest.json'
+OBJECTS = 'objects'
+
+
+def atomic_write(path, data):
+    """Write ``data`` (bytes) to ``path`` so that readers never see a partial file."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            file.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        # E.g. a full disk, which the partial file would only fill up further
+        os.remove(tmp_path)
+        raise
+
+
+class StoryCache:
+    """Two-tier (memory LRU, then disk) cache with single-flight builds."""
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, directory=None, max_disk_bytes=DEFAULT_MAX_DISK_BYTES):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self._lock = threading.Lock()
+        # Serializes deleting from the disk tier
+        self._disk_lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._disk_bytes = 0
+        self._building = {}
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_evictions = 0
+        self.disk_errors = 0
+        if directory:
+            try:
+                os.makedirs(directory, exist_ok=True)
+                self._disk_bytes = sum(size for _, size, _ in self._disk_files())
+            except OSError as error:
+                self._disk_error('cannot use the story cache directory %s: %s', directory, error)
+
+    @staticmethod
+    def digest(key):
+        """Return the hex digest naming ``key`` (a JSON-serializable tuple) on disk."""
+        return hashlib.sha256(json.dumps(key).encode()).hexdigest()
+
+    def get_or_build(self, key, build):
+        """Return the bytes cached for ``key``, calling ``build()`` to produce them on a miss.
+
+        The same bytes object is handed to every caller, so it must not be copied
+        needlessly. When several threads miss the same key at once, one of them
+        builds and the others wait for its result.
+        """
+        digest = self.digest(key)
+        with self._lock:
+            value = self._entries.get(digest)
+            if value is not None:
+                self._entries.move_to_end(digest)
+                self.hits += 1
+                return value
+            future = self._building.get(digest)
+            owner = future is None
+            if owner:
+                future = self._building[digest] = Future()
+        if not owner:
+            return future.result()
+
+        try:
+            value = self._read(digest)
+            if value is None:
+                value = build()
+                self._write(digest, value)
+                with self._lock:
+                    self.misses += 1
+            else:
+                with self._lock:
+                    self.disk_hits += 1
+            self._remember(digest, value)
+        except BaseException as error:
+            future.set_exception(error)
+            raise
+        else:
+            future.set_result(value)
+        finally:
+            with self._lock:
+                del self._building[digest]
+        return value
+
+    def _remember(self, digest, value):
+        with self._lock:
+            if len(value) > self.max_bytes:
+                return
+            self._entries[digest] = value
+            self._bytes += len(value)
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+                self.evictions += 1
+
+    def _path(self, digest):
+        return os.path.join(self.directory, digest[:2], digest + '.html')
+
+    def _disk_error(self, message, *args):
+        with self._lock:
+            self.disk_errors += 1
+        logger.warning(message, *args)
+
+    def _read(self, digest):
+        if not self.directory:
+            return None
+        path = self._path(digest)
+        try:
+            with open(path, 'rb') as file:
+                value = file.read()
+            # The mtime orders the files for eviction
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        except OSError as error:
+            self._disk_error('cannot read the cached story %s: %s', path, error)
+            return None
+        return value
+
+    def _write(self, digest, value):
+        if not self.directory:
+            return
+        try:
+            atomic_write(self._path(digest), value)
+        except OSError as error:
+            self._disk_error('cannot write the cached story %s: %s', self._path(digest), error)
+            return
+        with self._lock:
+            self._disk_bytes += len(value)
+            over_budget = self._disk_bytes > self.max_disk_bytes
+        if over_budget:
+            self._evict_disk()
+
+    def _disk_files(self):
+        # (path, size, mtime) of every story on disk
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.is_dir():
+                for file in os.scandir(entry.path):
+                    if file.name.endswith('.html'):
+                        stat = file.stat()
+                        files.append((file.path, stat.st_size, stat.st_mtime))
+        return files
+
+    def _evict_disk(self):
+        with self._disk_lock:
+            try:
+                files = sorted(self._disk_files(), key=lambda file: file[2])
+            except OSError as error:
+                self._disk_error('cannot list the story cache directory %s: %s', self.directory, error)
+                return
+            total = sum(size for _, size, _ in files)
+            evicted = 0
+            for path, size, _ in files:
+                if total <= self.max_disk_bytes * DISK_LOW_WATER:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                except OSError as error:
+                    self._disk_error('cannot delete the cached story %s: %s', path, error)
+                    continue
+                total -= size
+                evicted += 1
+            with self._lock:
+                self._disk_bytes = total
+                self.disk_evictions += evicted
+
+    def clear(self):
+        """Drop the memory tier (the disk tier is left alone)."""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """Return the hit/miss/eviction counters and the sizes of the memory and disk tiers."""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'disk_bytes': self._disk_bytes,
+                'disk_evictions': self.disk_evictions,
+                'disk_errors': self.disk_errors,
+            }
+
+
+def object_path(directory, object_id):
+    return os.path.join(directory, OBJECTS, object_id[:2], object_id + '.html.gz')
+
+
+def read_manifest(directory):
+    try:
+        with open(os.path.join(directory, MANIFEST), encoding='utf8') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {'stories': {}}
+
+
+class PrerenderedStories:
+    """Read access to a pre-rendered story directory, reloading its manifest when it changes."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._stories = {}
+
+    def _current_stories(self):
+        try:
+            mtime = os.path.getmtime(os.path.join(self.directory, MANIFEST))
+        except FileNotFoundError:
+            return {}
+        with self._lock:
+            if mtime != self._mtime:
+                self._stories = read_manifest(self.directory)['stories']
+                self._mtime = mtime
+            return self._stories
+
+    def get(self, key):
+        """Return the pre-rendered HTML (UTF-8 bytes) for a story key, or None."""
+        entry = self._current_stories().get(StoryCache.digest(key))
+        if entry is None:
+            return None
+        try:
+            with open(object_path(self.directory, entry['object']), 'rb') as file:
+                return gzip.decompress(file.read())
+        except FileNotFoundError:
+            return None
+
+
+_lock = threading.Lock()
+_story_cache = None
+_prerendered = None
+
+
+def get_story_cache():
+    """Return the process-wide story cache.
+
+    Its budgets and directory come from ``AGEMATES_CACHE_BYTES``,
+    ``AGEMATES_CACHE_DISK_BYTES`` and ``AGEMATES_CACHE_DIR``; without a
+    directory only the memory tier is used.
+    """
+    global _story_cache
+    with _lock:
+        if _story_cache is None:
+            max_bytes = int(os.environ.get('AGEMATES_CACHE_BYTES', DEFAULT_MAX_BYTES))
+            max_disk_bytes = int(os.environ.get('AGEMATES_CACHE_DISK_BYTES', DEFAULT_MAX_DISK_BYTES))
+            _story_cache = StoryCache(max_bytes, os.environ.get('AGEMATES_CACHE_DIR') or None, max_disk_bytes)
+        return _story_cache
+
+
+def get_prerendered():
+    """Return the store named by ``AGEMATES_PRERENDER_DIR``, or None when it is not set."""
+    global _prerendered
+    directory = os.environ.get('AGEMATES_PRERENDER_DIR')
+    if not directory:
+        return None
+    with _lock:
+        if _prerendered is None or _prerendered.directory != directory:
+            _prerendered = PrerenderedStories(directory)
+        return _prerendered
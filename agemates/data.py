@@ -0,0 +1,430 @@
+"""Loading of the population dataset.
+
+The dataset is parsed at most once per process and the resulting frame is
+shared by every Streamlit session, so callers must treat it as read-only and
+derive per-selection columns on copies (``assign``, ``take``, ...).
+
+When the CSV comes from ``agemates.build``, its build manifest lists the
+checksums of the CSV and of the artifacts next to it. Artifacts are then only
+used when their checksum matches, and the CSV is read in the encoding the
+manifest declares.
+
+The frame and everything derived from it (``load_derived``) form a
+``Snapshot`` of one version of the dataset, identified by the CSV's content
+hash. The files are checked for changes at most every
+``AGEMATES_RELOAD_INTERVAL`` seconds (default 2, 0 disables); a changed
+dataset is parsed and its derived structures rebuilt in a background thread,
+then the new snapshot replaces the old one in a single assignment. Callers
+that need several consistent reads ``pin`` a snapshot for their duration.
+Caches keyed by ``dataset_fingerprint`` miss on the new version by
+themselves, nothing is flushed.
+
+How a dataset is read into the frame of its snapshot is up to a query
+backend, ``AGEMATES_BACKEND`` (default ``auto``: arrow for a ``.parquet``
+dataset, else pandas). ``pandas`` reads every row (``read_dataset``). ``arrow``
+is for datasets far larger than data.csv, e.g. by single year of age or by
+sub-national region: everything the story derives only looks at one row per
+Year×Country×Gender cohort, so ``read_cohorts`` streams the Parquet file
+through pyarrow's dataset scanner, reads only the columns of data.csv and sums
+the rows into cohorts batch by batch. Its memory is bounded by the number of
+cohorts, not by the rows of the file.
+"""
+import contextlib
+import contextvars
+import hashlib
+import importlib.util
+import json
+import logging
+import os
+import threading
+import time
+
+from agemates.metrics import span
+
+# pandas and pyarrow are imported when a dataset is read, not with this module, so that the
+# first paint of the app (see agemates.startup) does not wait for them. pyarrow is optional,
+# the binary artifacts are only used where it is installed
+HAVE_PYARROW = importlib.util.find_spec('pyarrow') is not None
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# The dataset of the app and the story API, e.g. a large Parquet dataset for the arrow backend
+DATA_CSV = os.environ.get('AGEMATES_DATASET') or os.path.join(BASE_DIR, 'data.csv')
+CSV_ENCODING = 'ISO-8859-1'
+
+# Column order of data.csv
+COLUMNS = ['Year', 'ISO3_code', 'Country', 'Subregion', 'Continent', 'Population', 'Gender', 'G_Type', 'Generation']
+
+CATEGORY_COLUMNS = ['ISO3_code', 'Country', 'Subregion', 'Continent', 'Gender', 'G_Type', 'Generation']
+
+# Year fits 1950-2024 and a single country/year/gender cohort stays well below 2**31
+DTYPES = {'Year': 'int16', 'Population': 'int32'}
+DTYPES.update({column: 'category' for column in CATEGORY_COLUMNS})
+
+# Preconverted artifacts looked up next to the CSV, in order of preference
+ARTIFACT_SUFFIXES = ['.feather', '.parquet']
+
+# Written next to the CSV by agemates.build
+BUILD_MANIFEST = 'build-manifest.json'
+
+# Rows per batch that read_cohorts reduces at once
+COHORT_BATCH_ROWS = 1 << 17
+
+# Seconds between two checks of the dataset files for changes, 0 disables hot reloading
+RELOAD_INTERVAL = float(os.environ.get('AGEMATES_RELOAD_INTERVAL', 2))
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+# Serializes parsing, so that a dataset is never parsed twice at the same time
+_load_lock = threading.Lock()
+_snapshots = {}
+_reloading = set()
+_fingerprints = {}
+_pinned = contextvars.ContextVar('agemates_pinned_snapshots', default={})
+
+
+class Snapshot:
+    """One version of a dataset: the frame and the structures derived from it, all read-only."""
+
+    def __init__(self, csv_path, fingerprint, signature, df):
+        self.csv_path = csv_path
+        self.fingerprint = fingerprint
+        # Size and mtime of the files the version was read from
+        self.signature = signature
+        self.df = df
+        self.checked = time.monotonic()
+        self._derived = {}
+
+    def derived(self, factory):
+        """Return ``factory(df)``, or ``factory.from_snapshot(snapshot)`` if it has one, built once per snapshot."""
+        with _lock:
+            value = self._derived.get(factory)
+        if value is None:
+            from_snapshot = getattr(factory, 'from_snapshot', None)
+            value = from_snapshot(self) if from_snapshot else factory(self.df)
+            with _lock:
+                value = self._derived.setdefault(factory, value)
+        return value
+
+    def factories(self):
+        with _lock:
+            return list(self._derived)
+
+    def read_built(self, name):
+        """Return the content of the file ``name`` (e.g. ``aggregates/year.parquet``) of this version's build, or None.
+
+        Only if the build manifest next to the dataset was written for this version
+        and the checksum of the file matches it.
+        """
+        directory = os.path.dirname(self.csv_path)
+        try:
+            with open(os.path.join(directory, BUILD_MANIFEST), encoding='utf8') as file:
+                files = json.load(file)['files']
+        except FileNotFoundError:
+            return None
+        dataset = files.get(os.path.basename(self.csv_path))
+        if dataset is None or dataset['sha256'] != self.fingerprint or name not in files:
+            return None
+        try:
+            with open(os.path.join(directory, *name.split('/')), 'rb') as file:
+                content = file.read()
+        except FileNotFoundError:
+            content = None
+        # Checked on the bytes that are used, the file may be rebuilt meanwhile
+        if content is None or hashlib.sha256(content).hexdigest() != files[name]['sha256']:
+            logger.warning('%s does not match %s, ignoring it', name, BUILD_MANIFEST)
+            return None
+        return content
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def build_manifest(csv_path):
+    """Return the build manifest of ``csv_path`` if the CSV is the one it was built with, else None."""
+    path = os.path.join(os.path.dirname(os.path.abspath(csv_path)), BUILD_MANIFEST)
+    try:
+        with open(path, encoding='utf8') as file:
+            manifest = json.load(file)
+    except FileNotFoundError:
+        return None
+    entry = manifest['files'].get(os.path.basename(csv_path))
+    if entry is None or entry['sha256'] != file_fingerprint(csv_path):
+        logger.warning('%s does not match %s, ignoring it', csv_path, path)
+        return None
+    return manifest
+
+
+def find_artifact(csv_path):
+    """Return the freshest (or, for built datasets, verified) binary artifact next to ``csv_path``, or None."""
+    if not HAVE_PYARROW:
+        return None
+    stem = os.path.splitext(csv_path)[0]
+    manifest = build_manifest(csv_path) if os.path.exists(csv_path) else None
+    csv_mtime = os.path.getmtime(csv_path) if os.path.exists(csv_path) else 0
+    for suffix in ARTIFACT_SUFFIXES:
+        path = stem + suffix
+        if not os.path.exists(path):
+            continue
+        if manifest is not None:
+            entry = manifest['files'].get(os.path.basename(path))
+            if entry is not None and entry['sha256'] == file_sha256(path):
+                return path
+            logger.warning('%s does not match %s, ignoring it', path, BUILD_MANIFEST)
+        # An artifact older than the CSV is stale and ignored
+        elif os.path.getmtime(path) >= csv_mtime:
+            return path
+    return None
+
+
+def _with_blank_category(df):
+    # ipyvizzu calls fillna('') on every dimension (the ISO3 code of Curacao is missing),
+    # which a categorical column only accepts if '' is one of its categories
+    for column in CATEGORY_COLUMNS:
+        if '' not in df[column].cat.categories:
+            df[column] = df[column].cat.add_categories([''])
+    return df
+
+
+def _with_dtypes(df):
+    # Artifacts are written with DTYPES, so usually nothing is cast and the memory-mapped columns stay as they are
+    mismatched = {column: dtype for column, dtype in DTYPES.items() if str(df[column].dtype) != dtype}
+    return df.astype(mismatched) if mismatched else df
+
+
+def read_dataset(csv_path=DATA_CSV):
+    """Parse the dataset from its binary artifact or, failing that, the CSV."""
+    import pandas as pd
+
+    artifact = find_artifact(csv_path)
+    if artifact is None:
+        manifest = build_manifest(csv_path)
+        encoding = manifest['encoding'] if manifest else CSV_ENCODING
+        df = pd.read_csv(csv_path, encoding=encoding, usecols=COLUMNS, dtype=DTYPES)[COLUMNS]
+        return _with_blank_category(df)
+    if artifact.endswith('.feather'):
+        import pyarrow.feather as feather
+
+        # Memory-mapped, so numeric columns are not copied into the heap
+        table = feather.read_table(artifact, memory_map=True)
+    else:
+        import pyarrow.parquet as parquet
+
+        table = parquet.read_table(artifact, memory_map=True)
+    # Selected on the table, which reorders without copying, unlike selecting on the frame
+    df = table.select(COLUMNS).to_pandas(split_blocks=True)
+    return _with_blank_category(_with_dtypes(df))
+
+
+def read_cohorts(parquet_path, batch_rows=COHORT_BATCH_ROWS):
+    """Read a Parquet dataset of any granularity as one row per cohort, in order of first appearance.
+
+    Rows are summed by every column of data.csv but Population, so extra columns
+    (age, region, ...) are summed away. Only those columns are read, and only one
+    batch of rows and the cohorts seen so far are held in memory.
+    """
+    import numpy as np
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    keys = [column for column in COLUMNS if column != 'Population']
+    # The position of its first row comes along with every cohort, group_by does not keep the order
+    names = [column + '_sum' if column == 'Population' else column for column in COLUMNS] + ['First_min']
+    cohorts = None
+    offset = 0
+    for batch in ds.dataset(parquet_path, format='parquet').to_batches(columns=COLUMNS, batch_size=batch_rows):
+        table = pa.Table.from_batches([batch]).append_column('First', pa.array(np.arange(offset, offset + len(batch))))
+        offset += len(batch)
+        if cohorts is not None:
+            # The sums are int64, and every batch has dictionaries of its own
+            table = pa.concat_tables([cohorts, table.cast(cohorts.schema)]).unify_dictionaries()
+        grouped = table.group_by(keys).aggregate([('Population', 'sum'), ('First', 'min')])
+        cohorts = grouped.select(names).rename_columns(COLUMNS + ['First'])
+    if cohorts is None:
+        raise ValueError(f'{parquet_path} has no rows')
+    cohorts = cohorts.sort_by('First').drop_columns('First')
+    df = cohorts.to_pandas()
+    return _with_blank_category(df.astype(DTYPES))
+
+
+# Query backends: name -> function reading a dataset into the frame of its snapshot
+BACKENDS = {'pandas': read_dataset, 'arrow': read_cohorts}
+
+BACKEND = os.environ.get('AGEMATES_BACKEND', 'auto')
+
+
+def dataset_backend(csv_path=DATA_CSV):
+    """Return the name of the backend reading ``csv_path``, see ``BACKEND``."""
+    if BACKEND != 'auto':
+        if BACKEND not in BACKENDS:
+            raise ValueError(f'unknown AGEMATES_BACKEND {BACKEND!r}, expected auto or one of {", ".join(BACKENDS)}')
+        return BACKEND
+    return 'arrow' if csv_path.endswith('.parquet') and HAVE_PYARROW else 'pandas'
+
+
+def file_signature(csv_path):
+    """Return the size and mtime of the CSV, its artifacts and its build manifest, which change with the dataset."""
+    stem = os.path.splitext(csv_path)[0]
+    paths = [csv_path, os.path.join(os.path.dirname(csv_path), BUILD_MANIFEST)]
+    paths += [stem + suffix for suffix in ARTIFACT_SUFFIXES]
+    signature = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            signature.append(None)
+        else:
+            signature.append((stat.st_size, stat.st_mtime_ns))
+    return tuple(signature)
+
+
+def _read_snapshot(csv_path, signature, span_name):
+    backend = dataset_backend(csv_path)
+    with span(span_name, backend=backend) as fields:
+        fingerprint = file_fingerprint(csv_path)
+        snapshot = Snapshot(csv_path, fingerprint, signature, BACKENDS[backend](csv_path))
+        fields['rows'] = len(snapshot.df)
+    return snapshot
+
+
+def _reload(old):
+    """Swap in a new snapshot if the files of ``old`` changed, rebuilding its derived structures first."""
+    csv_path = old.csv_path
+    with _load_lock:
+        signature = file_signature(csv_path)
+        if signature == old.signature:
+            return old
+        try:
+            if file_fingerprint(csv_path) == old.fingerprint:
+                # Touched, or the artifacts were rebuilt from the same CSV
+                old.signature = signature
+                return old
+            new = _read_snapshot(csv_path, signature, 'reload')
+            for factory in old.factories():
+                new.derived(factory)
+        except Exception:
+            # Remembered as seen, so a broken file is retried when it changes again and not on every check
+            logger.exception('reloading %s failed, keeping version %s', csv_path, old.fingerprint[:12])
+            old.signature = signature
+            return old
+        if file_signature(csv_path) != signature:
+            # Written to while it was read, the next check reads it again
+            return old
+        with _lock:
+            _snapshots[csv_path] = new
+        logger.info('reloaded %s: version %s -> %s', csv_path, old.fingerprint[:12], new.fingerprint[:12])
+        return new
+
+
+def _reload_in_background(snapshot):
+    with _lock:
+        if snapshot.csv_path in _reloading:
+            return
+        _reloading.add(snapshot.csv_path)
+
+    def run():
+        try:
+            _reload(snapshot)
+        finally:
+            with _lock:
+                _reloading.discard(snapshot.csv_path)
+
+    threading.Thread(target=run, name='agemates-reload', daemon=True).start()
+
+
+def get_snapshot(csv_path=DATA_CSV):
+    """Return the pinned or else the current snapshot of the dataset, parsing it on first use only.
+
+    Every ``RELOAD_INTERVAL`` seconds a call checks the files and, if they changed,
+    starts reloading them in the background; until the new snapshot is swapped in,
+    callers keep getting the current one.
+    """
+    csv_path = os.path.abspath(csv_path)
+    snapshot = _pinned.get().get(csv_path)
+    if snapshot is not None:
+        return snapshot
+    with _lock:
+        snapshot = _snapshots.get(csv_path)
+    if snapshot is None:
+        with _load_lock:
+            with _lock:
+                snapshot = _snapshots.get(csv_path)
+            if snapshot is None:
+                snapshot = _read_snapshot(csv_path, file_signature(csv_path), 'load')
+                with _lock:
+                    _snapshots[csv_path] = snapshot
+    elif RELOAD_INTERVAL > 0 and time.monotonic() - snapshot.checked >= RELOAD_INTERVAL:
+        snapshot.checked = time.monotonic()
+        if file_signature(csv_path) != snapshot.signature:
+            _reload_in_background(snapshot)
+    return snapshot
+
+
+def reload_dataset(csv_path=DATA_CSV):
+    """Check the files of the dataset now and return the current snapshot, reloaded if they changed."""
+    return _reload(get_snapshot(csv_path))
+
+
+@contextlib.contextmanager
+def pinned(csv_path=DATA_CSV):
+    """Serve every dataset lookup of ``csv_path`` in this context from the same snapshot.
+
+    Wrap units of work, like a rerun or a request, that must not see a reload halfway.
+    """
+    snapshot = get_snapshot(csv_path)
+    token = _pinned.set({**_pinned.get(), snapshot.csv_path: snapshot})
+    try:
+        yield snapshot
+    finally:
+        _pinned.reset(token)
+
+
+def load_dataset(csv_path=DATA_CSV):
+    """Return the shared, typed dataset of the current snapshot."""
+    return get_snapshot(csv_path).df
+
+
+def dataset_fingerprint(csv_path=DATA_CSV):
+    """Return the version of the dataset: the content hash of the CSV its current snapshot was read from."""
+    return get_snapshot(csv_path).fingerprint
+
+
+def file_fingerprint(csv_path=DATA_CSV):
+    """Return a content hash of the CSV on disk, recomputed only when its size or mtime changes."""
+    csv_path = os.path.abspath(csv_path)
+    stat = os.stat(csv_path)
+    key = (csv_path, stat.st_size, stat.st_mtime_ns)
+    with _lock:
+        fingerprint = _fingerprints.get(key)
+    if fingerprint is None:
+        fingerprint = file_sha256(csv_path)
+        with _lock:
+            _fingerprints[key] = fingerprint
+    return fingerprint
+
+
+def load_derived(factory, csv_path=DATA_CSV):
+    """Return ``factory(df)`` for the shared dataset, built once per snapshot.
+
+    Used for the lookup structures (aggregates, indexes) derived from the dataset;
+    a reload rebuilds them before the new snapshot is swapped in. A factory with a
+    ``from_snapshot`` class method is given the snapshot instead, to load what
+    ``agemates.build`` precomputed (see ``Snapshot.read_built``).
+    """
+    return get_snapshot(csv_path).derived(factory)
+
+
+def write_artifact(df, path):
+    """Write ``df`` as a Feather or Parquet artifact, depending on ``path``."""
+    if not HAVE_PYARROW:
+        raise ImportError('pyarrow is required to write dataset artifacts')
+    if path.endswith('.feather'):
+        # Uncompressed, so that readers can memory-map it
+        df.reset_index(drop=True).to_feather(path, compression='uncompressed')
+    else:
+        df.to_parquet(path, index=False)
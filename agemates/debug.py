@@ -0,0 +1,77 @@
+"""Opt-in debug panels with the timing spans of the app.
+
+The spans of the current rerun are shown below the story form (a fragment,
+which cannot write to the sidebar), the process-wide totals in the sidebar.
+Shown when ``AGEMATES_DEBUG`` is set or the page is opened with ``?debug=1``;
+the recent profiles only when profiling is requested as well (see
+``agemates.profiling``).
+"""
+import os
+
+import streamlit as st
+
+from agemates.cache import get_story_cache
+from agemates.data import DATA_CSV, dataset_fingerprint
+from agemates.metrics import recent, stage_totals
+from agemates.profiling import profiling_requested, recent_profiles
+
+# Stages that span other stages, left out of the sum
+ENVELOPES = {'story', 'click', 'warm'}
+
+
+def debug_enabled():
+    """Return whether the debug sidebar is requested for this session."""
+    return bool(os.environ.get('AGEMATES_DEBUG')) or st.query_params.get('debug') == '1'
+
+
+def show_rerun_spans(spans):
+    """Show the ``spans`` of this rerun in an expander."""
+    # Only imported for the debug panels, the first paint does not need pandas
+    import pandas as pd
+
+    with st.expander('Debug: this rerun'):
+        if spans:
+            st.dataframe(pd.DataFrame(spans), hide_index=True)
+            st.text(f'{sum(entry["ms"] for entry in spans if entry["stage"] not in ENVELOPES):.1f} ms in stages')
+        else:
+            st.text('no spans')
+
+
+def show_debug_sidebar(csv_path=DATA_CSV):
+    """Show the version of the dataset at ``csv_path``, the per-stage totals and the story cache counters."""
+    import pandas as pd
+
+    with st.sidebar:
+        st.header('Debug')
+        st.caption(f'Dataset version {dataset_fingerprint(csv_path)[:12]}')
+
+        st.caption('Process totals')
+        totals = pd.DataFrame(
+            [(stage, count, seconds * 1e3 / count, rows, size)
+             for stage, (count, seconds, rows, size) in sorted(stage_totals().items())],
+            columns=['stage', 'count', 'mean ms', 'rows', 'bytes'],
+        )
+        st.dataframe(totals, hide_index=True)
+
+        st.caption('Story cache')
+        st.json(get_story_cache().stats())
+
+        with st.expander('Recent spans (all sessions)'):
+            st.dataframe(pd.DataFrame(recent()[::-1]), hide_index=True)
+
+        # The profiles of every session, so only for whoever may request one
+        if not profiling_requested():
+            return
+        profiles = recent_profiles()
+        with st.expander(f'Profiles ({len(profiles)})'):
+            if not profiles:
+                st.text('none yet')
+            else:
+                choice = st.selectbox('Rerun', range(len(profiles)), format_func=lambda i: profiles[i].label,
+                                      key='debug_profile')
+                profile = profiles[choice]
+                st.dataframe(pd.DataFrame(profile.hottest(), columns=['frame', 'location', 'self ms', 'total ms']),
+                             hide_index=True)
+                name = os.path.basename(profile.paths[0]) if profile.paths else 'profile.speedscope.json'
+                st.download_button('speedscope', profile.speedscope(), file_name=name, mime='application/json')
+                st.download_button('folded stacks', profile.folded(), file_name=name.replace('.speedscope.json', '.folded'))
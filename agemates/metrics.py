@@ -0,0 +1,204 @@
+"""Always-on timing spans of the story pipeline.
+
+Each stage (data load, derived columns, ordering, every slide, serialization,
+the ``html()`` call) is wrapped in a ``span`` that records its duration
+together with row counts and payload sizes into process-wide histograms. A
+span costs a couple of microseconds, so this stays on under load. The spans
+are exported as:
+
+- structured logs: one JSON object per span on the ``agemates.metrics``
+  logger at INFO level, off unless logging is configured for it;
+- Prometheus text format, served on ``/metrics`` by a small HTTP server when
+  ``AGEMATES_METRICS_SERVER=host:port`` is set, and written to
+  ``AGEMATES_METRICS_FILE`` (e.g. for the node exporter's textfile collector)
+  by ``export()``;
+- the opt-in debug sidebar (see ``agemates.debug``), from ``recent()`` and
+  the spans ``collect()``-ed during the current rerun.
+"""
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from agemates.cache import atomic_write, get_story_cache
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of the duration histogram buckets
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# Number of recent spans kept for the debug sidebar
+RECENT_SPANS = 256
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Stage:
+    """Duration histogram plus row and byte totals of one stage."""
+
+    __slots__ = ('buckets', 'count', 'seconds', 'rows', 'bytes')
+
+    def __init__(self):
+        self.buckets = [0] * len(BUCKETS)
+        self.count = 0
+        self.seconds = 0.0
+        self.rows = 0
+        self.bytes = 0
+
+    def add(self, seconds, rows, size):
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+                break
+        self.count += 1
+        self.seconds += seconds
+        self.rows += rows or 0
+        self.bytes += size or 0
+
+
+_lock = threading.Lock()
+_stages = {}
+_recent = deque(maxlen=RECENT_SPANS)
+_collected = contextvars.ContextVar('agemates_spans', default=None)
+
+
+def record(stage, seconds, rows=None, size=None, **fields):
+    """Record a finished span of ``stage`` that took ``seconds``.
+
+    ``rows`` and ``size`` (bytes) are summed per stage, other ``fields`` only
+    show up in the logs and on the debug sidebar.
+    """
+    entry = dict(stage=stage, ms=round(seconds * 1e3, 3), rows=rows, bytes=size, **fields)
+    with _lock:
+        stats = _stages.get(stage)
+        if stats is None:
+            stats = _stages[stage] = Stage()
+        stats.add(seconds, rows, size)
+        _recent.append(entry)
+    collected = _collected.get()
+    if collected is not None:
+        collected.append(entry)
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(json.dumps(entry, default=str))
+
+
+@contextmanager
+def span(stage, **fields):
+    """Time the enclosed block as ``stage``.
+
+    The yielded dict may be updated with ``rows``, ``size`` and other fields
+    known only at the end of the block.
+    """
+    fields = dict(fields)
+    start = time.perf_counter()
+    try:
+        yield fields
+    finally:
+        record(stage, time.perf_counter() - start, **fields)
+
+
+def collect():
+    """Start collecting the spans of the current thread (a rerun) and return their list."""
+    spans = []
+    _collected.set(spans)
+    return spans
+
+
+def recent():
+    """Return the most recent spans of all sessions, oldest first."""
+    with _lock:
+        return list(_recent)
+
+
+def stage_totals():
+    """Return {stage: (count, total seconds, rows, bytes)}."""
+    with _lock:
+        return {name: (stats.count, stats.seconds, stats.rows, stats.bytes) for name, stats in _stages.items()}
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def prometheus_text():
+    """Return the metrics in the Prometheus text exposition format."""
+    with _lock:
+        stages = {name: (list(stats.buckets), stats.count, stats.seconds, stats.rows, stats.bytes)
+                  for name, stats in sorted(_stages.items())}
+    lines = [
+        '# HELP agemates_stage_seconds Duration of the story pipeline stages.',
+        '# TYPE agemates_stage_seconds histogram',
+    ]
+    for name, (buckets, count, seconds, _, _) in stages.items():
+        label = _label(name)
+        cumulative = 0
+        for bound, hits in zip(BUCKETS, buckets):
+            cumulative += hits
+            lines.append(f'agemates_stage_seconds_bucket{{stage="{label}",le="{bound}"}} {cumulative}')
+        lines.append(f'agemates_stage_seconds_bucket{{stage="{label}",le="+Inf"}} {count}')
+        lines.append(f'agemates_stage_seconds_sum{{stage="{label}"}} {seconds:.6f}')
+        lines.append(f'agemates_stage_seconds_count{{stage="{label}"}} {count}')
+    lines += [
+        '# HELP agemates_stage_rows_total Rows processed by the story pipeline stages.',
+        '# TYPE agemates_stage_rows_total counter',
+    ]
+    lines += [f'agemates_stage_rows_total{{stage="{_label(name)}"}} {stage[3]}' for name, stage in stages.items()]
+    lines += [
+        '# HELP agemates_stage_bytes_total Payload bytes produced by the story pipeline stages.',
+        '# TYPE agemates_stage_bytes_total counter',
+    ]
+    lines += [f'agemates_stage_bytes_total{{stage="{_label(name)}"}} {stage[4]}' for name, stage in stages.items()]
+    cache_stats = get_story_cache().stats()
+    lines += [
+        '# HELP agemates_story_cache Story cache counters and memory tier size.',
+        '# TYPE agemates_story_cache gauge',
+    ]
+    lines += [f'agemates_story_cache{{stat="{name}"}} {value}' for name, value in sorted(cache_stats.items())]
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    """Serves ``prometheus_text()`` on ``/metrics``."""
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = prometheus_text().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', PROMETHEUS_CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(host='127.0.0.1', port=0):
+    """Serve ``/metrics`` from a daemon thread and return the server."""
+    server = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+    threading.Thread(target=server.serve_forever, name='agemates-metrics', daemon=True).start()
+    return server
+
+
+_server = None
+
+
+def export():
+    """Start the server of ``AGEMATES_METRICS_SERVER`` and write ``AGEMATES_METRICS_FILE``, when set."""
+    global _server
+    address = os.environ.get('AGEMATES_METRICS_SERVER')
+    if address:
+        with _lock:
+            if _server is None:
+                host, port = address.rsplit(':', 1)
+                _server = start_metrics_server(host, int(port))
+    path = os.environ.get('AGEMATES_METRICS_FILE')
+    if path:
+        atomic_write(os.path.abspath(path), prometheus_text().encode())
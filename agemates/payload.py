@@ -0,0 +1,137 @@
+"""The data shipped with a story, reduced to the rows the slides draw.
+
+Only the slides about the selected year look at individual countries, all
+other markers are Year×Continent×Generation totals. The story data is laid
+out in two parts:
+
+* a *head* of one zero-population row per year for the selected country and
+  gender. vizzu orders categories (legends, palette indices, the x axis) by
+  first appearance, and these rows put the selection first and the years in
+  ascending order, exactly like the full frame laid out by ``SelectionIndex``,
+  whose row permutations the story data is built from;
+* the *year frame*: every row of the selected year, countries in the order
+  they first appear in the dataset, followed by the other years summed over
+  Country, ISO3_code and Subregion. It only depends on the year, so it is
+  built once per year and can be published as a cacheable asset.
+"""
+import json
+import logging
+import threading
+
+import numpy as np
+import pandas as pd
+from ipyvizzu import Data, RawJavaScriptEncoder
+
+from agemates.data import DATA_CSV, load_derived
+from agemates.metrics import span
+from agemates.selection import SelectionIndex
+
+logger = logging.getLogger(__name__)
+
+# Dimensions that are kept on the aggregated rows
+AGGREGATE_KEYS = ['Year', 'Continent', 'Generation', 'Gender', 'G_Type', 'IsSelectedYear']
+
+# Dimensions summed away on the aggregated rows, they are left blank there
+BLANK_COLUMNS = ['ISO3_code', 'Country', 'Subregion']
+
+class StoryData:
+    """Builds the reduced story data of any selection."""
+
+    def __init__(self, df, index=None):
+        self._df = df
+        self._index = SelectionIndex(df) if index is None else index
+        year_order = self._index.year_order
+        # Rank of every country by where it first appears in year order
+        country_codes = df['Country'].cat.codes.to_numpy()
+        first_seen = np.full(len(df['Country'].cat.categories), len(df))
+        np.minimum.at(first_seen, country_codes[year_order], np.arange(len(df)))
+        self._row_rank = first_seen[country_codes]
+        self._lock = threading.Lock()
+        self._year_frames = {}
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        """Return the story data of the snapshot, sharing its ``SelectionIndex``."""
+        return cls(snapshot.df, snapshot.derived(SelectionIndex))
+
+    def _flagged(self, rows, year):
+        frame = self._df.take(rows)
+        is_selected_year = np.where(frame['Year'].to_numpy() == year, 'yes', 'no')
+        return frame.assign(IsSelectedYear=is_selected_year.astype(object))
+
+    def head(self, year, country, gender):
+        """Return the zero-population rows that fix the category order for a selection."""
+        with span('derive') as fields:
+            head = self._flagged(self._index.rows(country, gender), year)
+            head['Population'] = head['Population'].dtype.type(0)
+            fields['rows'] = len(head)
+        return head
+
+    def first_frame(self, year, country, gender):
+        """Return the rows of the first slide: the selected cohort alone."""
+        with span('derive') as fields:
+            rows = self._index.rows(country, gender)
+            frame = self._flagged(rows[self._df['Year'].to_numpy()[rows] == year], year)
+            fields['rows'] = len(frame)
+        return frame
+
+    def year_frame(self, year):
+        """Return the selection-independent rows of the story for ``year``."""
+        with self._lock:
+            frame = self._year_frames.get(year)
+        if frame is None:
+            with span('order', year=year) as fields:
+                frame = self._build_year_frame(year)
+                fields['rows'] = len(frame)
+            with self._lock:
+                frame = self._year_frames.setdefault(year, frame)
+        return frame
+
+    def _build_year_frame(self, year):
+        in_year = self._df['Year'].to_numpy() == year
+        year_rows = np.flatnonzero(in_year)
+        year_rows = year_rows[np.argsort(self._row_rank[year_rows], kind='stable')]
+
+        year_order = self._index.year_order
+        rest = self._flagged(year_order[~in_year[year_order]], year)
+        totals = rest.groupby(AGGREGATE_KEYS, observed=True, sort=False)['Population'].sum().reset_index()
+        for column in BLANK_COLUMNS:
+            totals[column] = pd.Categorical([''] * len(totals), categories=self._df[column].cat.categories)
+        totals['Year'] = totals['Year'].astype(self._df['Year'].dtype)
+        totals['Population'] = totals['Population'].astype(self._df['Population'].dtype)
+
+        details = self._flagged(year_rows, year)
+        return pd.concat([details, totals[details.columns]], ignore_index=True)
+
+    def frame(self, year, country, gender):
+        """Return the complete reduced story frame of a selection."""
+        return pd.concat([self.head(year, country, gender), self.year_frame(year)], ignore_index=True)
+
+
+def load_story_data(csv_path=DATA_CSV):
+    """Return the shared ``StoryData`` of the dataset at ``csv_path``."""
+    return load_derived(StoryData, csv_path)
+
+
+def with_year2(frame):
+    """Add the ``Year2`` column, the year as a dimension for the x axis."""
+    return frame.assign(Year2=frame['Year'].astype(str))
+
+
+def vizzu_data(frame):
+    """Return ``frame`` as an ``ipyvizzu.Data``."""
+    data = Data()
+    data.add_df(frame)
+    return data
+
+
+def payload_bytes(data):
+    """Return the size of an ``ipyvizzu.Data`` once serialized into the story."""
+    # Data.build() would validate the data against its JSON schema again, which costs more than the dump
+    return len(json.dumps({'data': data}, cls=RawJavaScriptEncoder).encode())
+
+
+def log_payload(data, rows):
+    size = payload_bytes(data)
+    logger.info('story data: %d rows, %d bytes', rows, size)
+    return size
@@ -0,0 +1,140 @@
+"""Offline rendering of every story variant.
+
+    python -m agemates.prerender --out prerendered --jobs 8
+
+Stories are written gzip-compressed into a content-addressed ``objects``
+directory and listed in ``manifest.json`` under the digest of their cache key
+(see ``agemates.story.story_key``). Because the key includes the dataset and
+code fingerprints, a rerun only renders the variants that are missing or
+whose inputs changed, and an interrupted run resumes where it stopped. With
+``--gc`` the stories of other dataset and code versions are dropped from the
+manifest and their objects deleted, else the directory grows with every
+change. The app serves stories from this directory when
+``AGEMATES_PRERENDER_DIR`` points to it.
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from agemates.cache import MANIFEST, OBJECTS, StoryCache, atomic_write, object_path, read_manifest
+from agemates.data import DATA_CSV, load_dataset
+from agemates.story import build_html, story_key
+
+# Completed chunks between two manifest checkpoints
+CHECKPOINT_EVERY = 20
+
+
+def write_manifest(directory, manifest):
+    data = json.dumps(manifest, sort_keys=True, separators=(',', ':')).encode()
+    atomic_write(os.path.join(directory, MANIFEST), data)
+
+
+def render_one(directory, csv_path, selection):
+    """Render one (year, country, gender) into the object store and return its manifest entry."""
+    html = build_html(*selection, csv_path).encode()
+    object_id = hashlib.sha256(html).hexdigest()
+    path = object_path(directory, object_id)
+    if not os.path.exists(path):
+        atomic_write(path, gzip.compress(html, mtime=0))
+    digest = StoryCache.digest(story_key(*selection, csv_path))
+    return digest, {'object': object_id, 'selection': list(selection)}
+
+
+def _render_chunk(directory, csv_path, selections):
+    return [render_one(directory, csv_path, selection) for selection in selections]
+
+
+def all_selections(csv_path=DATA_CSV):
+    df = load_dataset(csv_path)
+    years = sorted(int(year) for year in df['Year'].unique())
+    countries = list(df['Country'].drop_duplicates())
+    genders = list(df['Gender'].drop_duplicates())
+    return [(year, country, gender) for year in years for country in countries for gender in genders]
+
+
+def pending_selections(directory, csv_path, selections, manifest):
+    """Return the selections that have no up-to-date story in the store yet."""
+    stories = manifest['stories']
+    pending = []
+    for selection in selections:
+        entry = stories.get(StoryCache.digest(story_key(*selection, csv_path)))
+        if entry is None or not os.path.exists(object_path(directory, entry['object'])):
+            pending.append(selection)
+    return pending
+
+
+def prerender(directory, csv_path=DATA_CSV, selections=None, jobs=None, chunk_size=25, log=print):
+    """Render every missing story variant into ``directory`` over a process pool."""
+    csv_path = os.path.abspath(csv_path)
+    if selections is None:
+        selections = all_selections(csv_path)
+    manifest = read_manifest(directory)
+    pending = pending_selections(directory, csv_path, selections, manifest)
+    log(f'{len(selections) - len(pending)} of {len(selections)} stories up to date, rendering {len(pending)}')
+
+    chunks = [pending[i:i + chunk_size] for i in range(0, len(pending), chunk_size)]
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(_render_chunk, directory, csv_path, chunk) for chunk in chunks]
+        for done, future in enumerate(as_completed(futures), 1):
+            manifest['stories'].update(future.result())
+            if done % CHECKPOINT_EVERY == 0:
+                write_manifest(directory, manifest)
+                log(f'{done}/{len(chunks)} chunks rendered')
+    write_manifest(directory, manifest)
+    return len(pending)
+
+
+def collect_garbage(directory, csv_path=DATA_CSV, log=print):
+    """Drop the stories that are not of the current dataset and code version, return the objects deleted.
+
+    The manifest is written first, so the app never looks up a deleted object.
+    """
+    csv_path = os.path.abspath(csv_path)
+    current = {StoryCache.digest(story_key(*selection, csv_path)) for selection in all_selections(csv_path)}
+    manifest = read_manifest(directory)
+    stale = [digest for digest in manifest['stories'] if digest not in current]
+    for digest in stale:
+        del manifest['stories'][digest]
+    write_manifest(directory, manifest)
+
+    referenced = {entry['object'] for entry in manifest['stories'].values()}
+    deleted = 0
+    for root, _, files in os.walk(os.path.join(directory, OBJECTS)):
+        for name in files:
+            if name.endswith('.html.gz') and name[:-len('.html.gz')] not in referenced:
+                os.remove(os.path.join(root, name))
+                deleted += 1
+    log(f'dropped {len(stale)} stale stories, deleted {deleted} objects')
+    return deleted
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Pre-render every My Age-Mates story variant.')
+    parser.add_argument('--out', default='prerendered', help='output directory (default: %(default)s)')
+    parser.add_argument('--csv', default=DATA_CSV, help='dataset to render from (default: data.csv)')
+    parser.add_argument('--jobs', type=int, default=None, help='worker processes (default: CPU count)')
+    parser.add_argument('--years', type=int, nargs='*', help='only render these years')
+    parser.add_argument('--countries', nargs='*', help='only render these countries')
+    parser.add_argument('--genders', nargs='*', help='only render these genders')
+    parser.add_argument('--gc', action='store_true',
+                        help='afterwards delete the stories of other dataset and code versions')
+    args = parser.parse_args(argv)
+
+    selections = [
+        (year, country, gender) for year, country, gender in all_selections(args.csv)
+        if (not args.years or year in args.years)
+        and (not args.countries or country in args.countries)
+        and (not args.genders or gender in args.genders)
+    ]
+    log = lambda message: print(message, file=sys.stderr)  # noqa: E731
+    prerender(args.out, args.csv, selections, args.jobs, log=log)
+    if args.gc:
+        collect_garbage(args.out, args.csv, log=log)
+
+
+if __name__ == '__main__':
+    main()
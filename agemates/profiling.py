@@ -0,0 +1,238 @@
+"""Operator-only profiling of single reruns, saved as speedscope and flamegraph files.
+
+A function decorated with ``profiled`` (the story form) is profiled on the
+reruns an operator asks for: every rerun while ``AGEMATES_PROFILE`` is set, or
+a rerun of a page opened with ``?profile=<AGEMATES_PROFILE_TOKEN>``. A thread
+samples the rerun's stack every ``AGEMATES_PROFILE_INTERVAL`` seconds (default
+0.001; the interpreter's switch interval is lowered to match while a profile
+runs), so pandas, slide construction and ipyvizzu's serialization all show up
+with their callers, at a cost only paid when profiling.
+
+Every profile is tagged with what the rerun ``tag_profile``-d (the selection)
+and written to ``AGEMATES_PROFILE_DIR`` (default ``.profiles``) as a speedscope
+file (https://www.speedscope.app) and as folded stacks for flamegraph.pl. The
+last ``AGEMATES_PROFILE_KEEP`` (default 20) profiles are kept in memory for the
+debug sidebar; older files are deleted.
+"""
+import collections
+import contextvars
+import functools
+import hmac
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+
+import streamlit as st
+
+from agemates.cache import atomic_write
+from agemates.data import BASE_DIR
+
+logger = logging.getLogger(__name__)
+
+INTERVAL = float(os.environ.get('AGEMATES_PROFILE_INTERVAL', 0.001))
+PROFILE_DIR = os.environ.get('AGEMATES_PROFILE_DIR') or os.path.join(BASE_DIR, '.profiles')
+KEEP = int(os.environ.get('AGEMATES_PROFILE_KEEP', 20))
+
+SPEEDSCOPE_SCHEMA = 'https://www.speedscope.app/file-format-schema.json'
+
+_lock = threading.Lock()
+_profiles = collections.deque()
+_tags = contextvars.ContextVar('agemates_profile_tags', default=None)
+# Profiles running, and the switch interval to restore once none is
+_running = 0
+_switch_interval = None
+
+
+def profiling_requested():
+    """Return whether the operator asked for this rerun to be profiled."""
+    if os.environ.get('AGEMATES_PROFILE'):
+        return True
+    token = os.environ.get('AGEMATES_PROFILE_TOKEN')
+    return bool(token) and hmac.compare_digest(st.query_params.get('profile', ''), token)
+
+
+def tag_profile(**tags):
+    """Tag the profile of the current rerun, if it is profiled, e.g. with the selection."""
+    current = _tags.get()
+    if current is not None:
+        current.update(tags)
+
+
+class Sampler(threading.Thread):
+    """Samples the stack of thread ``thread_id`` below frame ``root`` until stopped."""
+
+    def __init__(self, thread_id, root, interval=INTERVAL):
+        super().__init__(name='agemates-profiler', daemon=True)
+        self.thread_id = thread_id
+        self.root = root
+        self.interval = interval
+        self.samples = []
+        self.weights = []
+        self._done = threading.Event()
+
+    def run(self):
+        last = time.perf_counter()
+        while not self._done.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            now = time.perf_counter()
+            stack = []
+            while frame is not None and frame is not self.root:
+                stack.append(frame.f_code)
+                frame = frame.f_back
+            if stack:
+                self.samples.append(stack[::-1])
+                self.weights.append(now - last)
+            last = now
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+
+def _frame_name(code):
+    path = code.co_filename
+    if path.startswith(BASE_DIR):
+        path = os.path.relpath(path, BASE_DIR)
+    # co_qualname is new in Python 3.11
+    return getattr(code, 'co_qualname', code.co_name), path, code.co_firstlineno
+
+
+class Profile:
+    """The samples of one profiled rerun: stacks of frames, root first, each weighted in seconds."""
+
+    def __init__(self, name, tags, started, seconds, samples, weights):
+        self.name = name
+        self.tags = tags
+        self.started = started
+        self.seconds = seconds
+        index = {}
+        self.samples = []
+        for stack in samples:
+            self.samples.append([index.setdefault(_frame_name(code), len(index)) for code in stack])
+        self.frames = list(index)
+        self.weights = weights
+        self.paths = []
+
+    @property
+    def label(self):
+        tags = ' '.join(str(value) for value in self.tags.values())
+        return f'{time.strftime("%H:%M:%S", time.localtime(self.started))} {tags} ({self.seconds * 1e3:.0f} ms)'
+
+    def speedscope(self):
+        """Return the profile in speedscope's file format."""
+        return json.dumps({
+            '$schema': SPEEDSCOPE_SCHEMA,
+            'name': f'{self.name} {self.tags}',
+            'exporter': 'agemates.profiling',
+            'shared': {'frames': [{'name': name, 'file': file, 'line': line} for name, file, line in self.frames]},
+            'profiles': [{
+                'type': 'sampled',
+                'name': self.name,
+                'unit': 'milliseconds',
+                'startValue': 0,
+                'endValue': sum(self.weights) * 1e3,
+                'samples': self.samples,
+                'weights': [weight * 1e3 for weight in self.weights],
+            }],
+        })
+
+    def folded(self):
+        """Return the profile as folded stacks (``frame;frame;frame microseconds`` lines) for flamegraph.pl."""
+        stacks = collections.Counter()
+        for stack, weight in zip(self.samples, self.weights):
+            stacks[';'.join(self.frames[i][0] for i in stack)] += weight
+        return ''.join(f'{stack} {round(weight * 1e6)}\n' for stack, weight in stacks.most_common())
+
+    def hottest(self, limit=20):
+        """Return the frames with the most samples as (frame, file:line, self ms, total ms), by total."""
+        own = collections.Counter()
+        total = collections.Counter()
+        for stack, weight in zip(self.samples, self.weights):
+            own[stack[-1]] += weight
+            for i in set(stack):
+                total[i] += weight
+        return [
+            (self.frames[i][0], f'{self.frames[i][1]}:{self.frames[i][2]}', own[i] * 1e3, seconds * 1e3)
+            for i, seconds in total.most_common(limit)
+        ]
+
+    def save(self, directory=PROFILE_DIR):
+        """Write the speedscope and folded files into ``directory`` and return their paths."""
+        slug = re.sub(r'[^A-Za-z0-9]+', '_', '-'.join(str(value) for value in self.tags.values())).strip('_')
+        stamp = time.strftime('%Y%m%d-%H%M%S', time.localtime(self.started)) + f'.{int(self.started * 1000) % 1000:03d}'
+        stem = os.path.join(directory, stamp + (f'-{slug}' if slug else ''))
+        self.paths = [stem + '.speedscope.json', stem + '.folded']
+        atomic_write(self.paths[0], self.speedscope().encode())
+        atomic_write(self.paths[1], self.folded().encode())
+        return self.paths
+
+
+def _keep(profile):
+    with _lock:
+        _profiles.append(profile)
+        evicted = [_profiles.popleft() for _ in range(len(_profiles) - KEEP)]
+    for old in evicted:
+        for path in old.paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def recent_profiles():
+    """Return the kept profiles, newest first."""
+    with _lock:
+        return list(_profiles)[::-1]
+
+
+def _lower_switch_interval():
+    global _running, _switch_interval
+    with _lock:
+        if _running == 0:
+            _switch_interval = sys.getswitchinterval()
+            # The sampler only gets the GIL at switch points, so they must be as frequent as the samples
+            sys.setswitchinterval(min(_switch_interval, INTERVAL))
+        _running += 1
+
+
+def _restore_switch_interval():
+    global _running
+    with _lock:
+        _running -= 1
+        if _running == 0:
+            sys.setswitchinterval(_switch_interval)
+
+
+def profiled(func):
+    """Profile the calls of ``func`` that ``profiling_requested``, keeping and saving their profiles."""
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not profiling_requested():
+            return func(*args, **kwargs)
+        tags = {}
+        token = _tags.set(tags)
+        sampler = Sampler(threading.get_ident(), sys._getframe())
+        _lower_switch_interval()
+        started = time.time()
+        start = time.perf_counter()
+        sampler.start()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            sampler.stop()
+            seconds = time.perf_counter() - start
+            _restore_switch_interval()
+            _tags.reset(token)
+            profile = Profile(func.__qualname__, tags, started, seconds, sampler.samples, sampler.weights)
+            try:
+                profile.save()
+            except OSError as error:
+                logger.warning('could not save the profile of %s: %s', profile.label, error)
+            _keep(profile)
+
+    return wrapper
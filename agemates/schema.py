@@ -0,0 +1,92 @@
+"""The country, gender and generation dimension tables of the dataset.
+
+data.csv repeats the country, subregion, continent, gender type and generation
+strings on every row although they only depend on the country, the gender or
+the year. ``Schema`` splits them off:
+
+* ``countries``: Country → ISO3_code, Subregion, Continent, keyed by name
+  in first-appearance order (five countries have no ISO3 code);
+* ``genders``: Gender → G_Type;
+* ``generations``: Year → Generation.
+
+The metadata of a selection is a dict lookup. The populations are read from
+``agemates.aggregates`` and ``agemates.payload``, and the wide,
+category-encoded frame ipyvizzu is fed from stays the shared ``load_dataset``
+frame, so no fact table is kept here.
+"""
+import pandas as pd
+
+from agemates.data import DATA_CSV, load_derived
+
+
+# Function to match year with generation, agemates.build derives the Generation column with it
+def get_generation(year):
+    if 1946 <= year <= 1964:
+        return "Baby Boomer"
+    elif 1965 <= year <= 1980:
+        return "Gen X"
+    elif 1981 <= year <= 1996:
+        return "Millennial"
+    elif 1997 <= year <= 2012:
+        return "Gen Z"
+    else: 
+        return "Gen A"
+
+
+class Schema:
+    """Dimension tables of the dataset, with dict lookups of the metadata."""
+
+    def __init__(self, df):
+        countries = df.drop_duplicates('Country')
+        self.countries = pd.DataFrame({
+            'Country': countries['Country'].astype(str).to_numpy(),
+            'ISO3_code': countries['ISO3_code'].to_numpy(),
+            'Subregion': countries['Subregion'].to_numpy(),
+            'Continent': countries['Continent'].to_numpy(),
+        })
+        genders = df.drop_duplicates('Gender')
+        self.genders = pd.DataFrame({'Gender': genders['Gender'].to_numpy(), 'G_Type': genders['G_Type'].to_numpy()})
+        generations = df.drop_duplicates('Year').sort_values('Year')
+        self.generations = pd.DataFrame({
+            'Year': generations['Year'].to_numpy(), 'Generation': generations['Generation'].to_numpy(),
+        })
+
+        self._countries = self.countries.set_index('Country').to_dict('index')
+        self._g_types = dict(zip(self.genders['Gender'], self.genders['G_Type']))
+        self._generations = dict(zip(self.generations['Year'].tolist(), self.generations['Generation']))
+
+    def years(self):
+        """Return the range of birth years in the dataset."""
+        return range(min(self._generations), max(self._generations) + 1)
+
+    def has_country(self, country):
+        return country in self._countries
+
+    def has_gender(self, gender):
+        return gender in self._g_types
+
+    def country(self, country):
+        """Return {'ISO3_code', 'Subregion', 'Continent'} of ``country``; KeyError when unknown."""
+        return self._countries[country]
+
+    def g_type(self, gender):
+        return self._g_types[gender]
+
+    def generation(self, year):
+        return self._generations[year]
+
+    def generation_by_year(self):
+        """Return {year: generation}."""
+        return dict(self._generations)
+
+    def country_names(self):
+        """Return the countries in the order they first appear in the dataset."""
+        return self.countries['Country'].tolist()
+
+    def gender_names(self):
+        return self.genders['Gender'].tolist()
+
+
+def load_schema(csv_path=DATA_CSV):
+    """Return the shared ``Schema`` of the dataset at ``csv_path``."""
+    return load_derived(Schema, csv_path)
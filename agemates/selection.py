@@ -0,0 +1,47 @@
+"""Per-selection layout of the dataset.
+
+The story data lists the rows of the selected country and gender first and
+everything else after them, each part in ascending year order, with an
+``IsSelectedYear`` flag. vizzu orders categories by first appearance, so this
+order is what puts the selection first in every legend and palette.
+"""
+import numpy as np
+
+from agemates.data import DATA_CSV, load_derived
+
+_NO_ROWS = np.array([], dtype=np.intp)
+
+
+class SelectionIndex:
+    """Row permutations from which a selection view is assembled without sorting."""
+
+    def __init__(self, df):
+        self._df = df
+        # A stable sort keeps the file order among rows of the same year, as sort_values did
+        self.year_order = np.argsort(df['Year'].to_numpy(), kind='stable')
+        ordered = df.take(self.year_order)
+        # Row positions of every country/gender, already in year order
+        groups = ordered.groupby(['Country', 'Gender'], observed=True, sort=False).indices
+        self._rows = {key: self.year_order[positions] for key, positions in groups.items()}
+
+    def rows(self, country, gender):
+        """Return the row positions of the selected country and gender, in year order."""
+        return self._rows.get((country, gender), _NO_ROWS)
+
+    def order(self, country, gender):
+        """Return the row positions of the dataset in selection order."""
+        rows = self.rows(country, gender)
+        rest = np.ones(len(self._df), dtype=bool)
+        rest[rows] = False
+        return np.concatenate([rows, self.year_order[rest[self.year_order]]])
+
+    def view(self, year, country, gender):
+        """Return a new frame in selection order with the ``IsSelectedYear`` column added."""
+        view = self._df.take(self.order(country, gender))
+        is_selected_year = np.where(view['Year'].to_numpy() == year, 'yes', 'no')
+        return view.assign(IsSelectedYear=is_selected_year.astype(object))
+
+
+def load_selection_index(csv_path=DATA_CSV):
+    """Return the shared selection index for the dataset at ``csv_path``."""
+    return load_derived(SelectionIndex, csv_path)
@@ -0,0 +1,166 @@
+"""Opt-in speculative story builds while the user is still choosing.
+
+With ``AGEMATES_SPECULATE=1`` every rerun of the story form hands the current
+selection to ``speculate``. Once a session has left its inputs alone for
+``AGEMATES_SPECULATE_DELAY`` seconds (default 0.3), a bounded pool of
+``AGEMATES_SPECULATE_WORKERS`` threads (default 2) builds the story into the
+shared story cache. "Create Story" then finds it there, or waits for the build
+in flight instead of starting its own (the cache's single-flight).
+
+A session has at most one queued selection, a newer one replaces it, and at
+most one build running. The newest selections are built first, and beyond
+``AGEMATES_SPECULATE_QUEUE`` queued selections (default 16) the oldest are
+dropped. Builds that already started cannot be stopped; they finish and their
+stories stay cached.
+"""
+import collections
+import logging
+import os
+import threading
+import time
+
+from agemates.data import DATA_CSV, pinned
+from agemates.metrics import record
+
+logger = logging.getLogger(__name__)
+
+
+class Job:
+    """A speculative build; ``state`` is queued, running, done, failed, superseded, dropped or cancelled."""
+
+    def __init__(self, session, selection, build, not_before):
+        self.session = session
+        self.selection = selection
+        self.build = build
+        self.not_before = not_before
+        self.state = 'queued'
+        self.finished = threading.Event()
+
+
+class SpeculativeBuilds:
+    """Bounded pool of speculative builds, newest selection first, one per session."""
+
+    def __init__(self, workers=2, max_queued=16, delay=0.3):
+        self.workers = workers
+        self.max_queued = max_queued
+        self.delay = delay
+        self.counters = collections.Counter()
+        self._condition = threading.Condition()
+        # Session -> its queued job, oldest first
+        self._queued = collections.OrderedDict()
+        # Session -> its queued or running job
+        self._latest = {}
+        self._running = set()
+        self._threads = []
+
+    def submit(self, session, selection, build):
+        """Queue ``build()`` for the ``selection`` of ``session``, replacing the session's queued one."""
+        with self._condition:
+            job = self._latest.get(session)
+            if job is not None and job.selection == selection:
+                return job
+            self._discard(self._queued.pop(session, None), 'superseded')
+            while len(self._queued) >= self.max_queued:
+                self._discard(self._queued.popitem(last=False)[1], 'dropped')
+            job = Job(session, selection, build, time.monotonic() + self.delay)
+            self._queued[session] = self._latest[session] = job
+            self.counters['submitted'] += 1
+            if len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._work, name='agemates-speculative', daemon=True)
+                self._threads.append(thread)
+                thread.start()
+            self._condition.notify()
+            return job
+
+    def job(self, session):
+        """Return the queued or running job of ``session``, or None."""
+        with self._condition:
+            return self._latest.get(session)
+
+    def cancel(self, session):
+        """Drop the queued job of ``session``, e.g. because the user asked for the story already."""
+        with self._condition:
+            self._discard(self._queued.pop(session, None), 'cancelled')
+
+    def _discard(self, job, state):
+        # Called with the condition held
+        if job is None:
+            return
+        job.state = state
+        self.counters[state] += 1
+        if self._latest.get(job.session) is job:
+            del self._latest[job.session]
+        job.finished.set()
+
+    def _next(self):
+        # Called with the condition held: the newest due job of a session without a running build
+        now = time.monotonic()
+        wait = None
+        for session, job in reversed(self._queued.items()):
+            if session in self._running:
+                continue
+            if job.not_before <= now:
+                return job, None
+            wait = job.not_before - now if wait is None else min(wait, job.not_before - now)
+        return None, wait
+
+    def _work(self):
+        while True:
+            with self._condition:
+                job, wait = self._next()
+                while job is None:
+                    self._condition.wait(wait)
+                    job, wait = self._next()
+                del self._queued[job.session]
+                job.state = 'running'
+                self._running.add(job.session)
+
+            start = time.perf_counter()
+            try:
+                job.build()
+                state = 'done'
+            except Exception:
+                logger.exception('speculative build of %s failed', job.selection)
+                state = 'failed'
+            record('speculative', time.perf_counter() - start, state=state)
+
+            with self._condition:
+                self._running.discard(job.session)
+                self._discard(job, state)
+                self._condition.notify_all()
+
+
+_lock = threading.Lock()
+_builds = None
+
+
+def speculation_enabled():
+    return bool(os.environ.get('AGEMATES_SPECULATE'))
+
+
+def get_speculative_builds():
+    """Return the process-wide pool, configured from the ``AGEMATES_SPECULATE_*`` variables."""
+    global _builds
+    with _lock:
+        if _builds is None:
+            _builds = SpeculativeBuilds(
+                int(os.environ.get('AGEMATES_SPECULATE_WORKERS', 2)),
+                int(os.environ.get('AGEMATES_SPECULATE_QUEUE', 16)),
+                float(os.environ.get('AGEMATES_SPECULATE_DELAY', 0.3)),
+            )
+        return _builds
+
+
+def speculate(session, selected_year, selected_country, selected_gender, csv_path=DATA_CSV):
+    """Build the story of a selection in the background, as ``cached_story`` would; return the job."""
+    selection = (int(selected_year), str(selected_country), str(selected_gender), os.path.abspath(csv_path))
+
+    def build():
+        # Not imported with this module, the app imports it for the first paint
+        from agemates.story import cached_story
+
+        # The key and every part of the story from one version, even if data.csv is reloaded meanwhile
+        with pinned(csv_path):
+            cached_story(selected_year, selected_country, selected_gender, csv_path)
+
+    return get_speculative_builds().submit(session, selection, build)
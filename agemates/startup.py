@@ -0,0 +1,167 @@
+"""Cold start fast path: the first paint from a metadata snapshot, the dataset loaded meanwhile.
+
+The input widgets only need the country and gender lists and the year bounds.
+They are kept in ``<csv stem>.metadata.json`` next to the CSV (written by
+``agemates.build``, or else by the first process that finds it missing)
+together with the content hash of the CSV they were taken from, so a new
+process paints the form without importing pandas or ipyvizzu and without
+parsing the CSV. ``warm_in_background`` then parses the dataset, builds its
+lookup structures and imports the story modules in a thread, so that the
+first "Create Story" finds them ready. A snapshot that does not match the CSV
+is ignored and rewritten.
+"""
+import json
+import logging
+import os
+import threading
+
+from streamlit.runtime.scriptrunner import add_script_run_ctx
+
+from agemates.cache import atomic_write
+from agemates.data import DATA_CSV, file_fingerprint, pinned
+from agemates.metrics import span
+
+logger = logging.getLogger(__name__)
+
+METADATA_SUFFIX = '.metadata.json'
+
+_lock = threading.Lock()
+_metadata = {}
+_warming = set()
+
+
+class Metadata:
+    """What the input widgets show: the countries and genders in dataset order and the year bounds."""
+
+    def __init__(self, countries, genders, first_year, last_year, fingerprint=None):
+        self.countries = list(countries)
+        self.genders = list(genders)
+        self.first_year = first_year
+        self.last_year = last_year
+        # Content hash of the CSV version it was taken from, if known
+        self.fingerprint = fingerprint
+
+    @classmethod
+    def from_schema(cls, schema, fingerprint=None):
+        years = schema.years()
+        return cls(schema.country_names(), schema.gender_names(), years.start, years.stop - 1, fingerprint)
+
+    def years(self):
+        """Return the range of birth years in the dataset."""
+        return range(self.first_year, self.last_year + 1)
+
+    def country_names(self):
+        return list(self.countries)
+
+    def gender_names(self):
+        return list(self.genders)
+
+
+def metadata_path(csv_path=DATA_CSV):
+    return os.path.splitext(os.path.abspath(csv_path))[0] + METADATA_SUFFIX
+
+
+def read_metadata(csv_path=DATA_CSV):
+    """Return the ``Metadata`` snapshot of ``csv_path`` if it was taken from the CSV on disk, else None."""
+    try:
+        with open(metadata_path(csv_path), encoding='utf8') as file:
+            snapshot = json.load(file)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as error:
+        logger.warning('ignoring the unreadable %s: %s', metadata_path(csv_path), error)
+        return None
+    if snapshot.get('sha256') != file_fingerprint(csv_path):
+        return None
+    return Metadata(snapshot['countries'], snapshot['genders'], *snapshot['years'], snapshot['sha256'])
+
+
+def write_metadata(csv_path=DATA_CSV, metadata=None):
+    """Write the ``Metadata`` snapshot next to the CSV and return it; taken from the parsed dataset unless given."""
+    if metadata is None:
+        from agemates.schema import load_schema
+
+        with pinned(csv_path) as snapshot:
+            metadata = Metadata.from_schema(load_schema(csv_path), snapshot.fingerprint)
+    elif metadata.fingerprint is None:
+        metadata.fingerprint = file_fingerprint(csv_path)
+    atomic_write(metadata_path(csv_path), json.dumps({
+        'sha256': metadata.fingerprint,
+        'countries': metadata.countries,
+        'genders': metadata.genders,
+        'years': [metadata.first_year, metadata.last_year],
+    }, ensure_ascii=False, indent=1).encode('utf8'))
+    return metadata
+
+
+def load_metadata(csv_path=DATA_CSV):
+    """Return the ``Metadata`` of the dataset, from its snapshot unless that is missing or stale.
+
+    Without a matching snapshot the dataset is parsed here and the snapshot
+    written for the next process. While a changed CSV is still being reloaded
+    that is the metadata of the previous version, which is neither written nor
+    kept, so that a later call picks up the new one.
+    """
+    key = (os.path.abspath(csv_path), file_fingerprint(csv_path))
+    with _lock:
+        metadata = _metadata.get(key)
+    if metadata is not None:
+        return metadata
+    with span('metadata'):
+        metadata = read_metadata(csv_path)
+    if metadata is None:
+        from agemates.schema import load_schema
+
+        with pinned(csv_path) as snapshot:
+            metadata = Metadata.from_schema(load_schema(csv_path), snapshot.fingerprint)
+        if metadata.fingerprint != key[1]:
+            return metadata
+        try:
+            write_metadata(csv_path, metadata)
+        except OSError as error:
+            logger.warning('could not write %s: %s', metadata_path(csv_path), error)
+    with _lock:
+        _metadata[key] = metadata
+    return metadata
+
+
+def warm(csv_path=DATA_CSV):
+    """Import the story modules, parse the dataset and build what the first story needs."""
+    with span('warm'):
+        # ipyvizzu and ipyvizzu-story come with the story modules
+        import agemates.story  # noqa: F401
+        from agemates.aggregates import load_cube
+        from agemates.assets import background_urls
+        from agemates.payload import load_story_data
+        from agemates.schema import load_schema
+        from agemates.template import story_template
+
+        # The template the stories are built from, see agemates.story.build_story
+        story_template(slide_count=1 if agemates.story.progressive_enabled() else None)
+        # The resized backgrounds the stories load by URL
+        background_urls(agemates.story.WIDTH, agemates.story.HEIGHT)
+        with pinned(csv_path):
+            load_schema(csv_path)
+            load_story_data(csv_path)
+            load_cube(csv_path)
+
+
+def warm_in_background(csv_path=DATA_CSV):
+    """Start ``warm`` in a thread, once per process and dataset."""
+    csv_path = os.path.abspath(csv_path)
+    with _lock:
+        if csv_path in _warming:
+            return
+        _warming.add(csv_path)
+
+    def run():
+        try:
+            warm(csv_path)
+        except Exception:
+            # The first story loads whatever is missing itself
+            logger.exception('warming up %s failed', csv_path)
+
+    thread = threading.Thread(target=run, name='agemates-warm', daemon=True)
+    # Started from a rerun: ipyvizzu-story looks for the script context when it is imported
+    add_script_run_ctx(thread)
+    thread.start()
@@ -0,0 +1,373 @@
+"""Construction of the My Age-Mates story for one selection.
+
+Progressive stories (opt-in with ``AGEMATES_PROGRESSIVE``) embed only what the
+first slide draws, the selected cohort and the first slide, so the player
+animates it right away. The complete story is a JSON slide spec (see
+``build_spec``) published next to the year frames, which the player fetches
+together with the year frame while the first slide plays. Without published
+assets there is nothing to fetch out of band, so stories are never progressive
+then.
+"""
+import json
+import os
+import re
+
+from ipyvizzu import Data
+from ipyvizzustory import Story
+
+from agemates.aggregates import load_cube
+from agemates.assets import background_urls, spec_asset_url, year_asset_url
+from agemates.backgrounds import background_fingerprint, background_script, inline_sources
+from agemates.cache import CODE_FINGERPRINT, get_prerendered, get_story_cache
+from agemates.data import DATA_CSV, dataset_fingerprint
+from agemates.metrics import span
+from agemates.payload import load_story_data, log_payload, with_year2
+from agemates.schema import load_schema
+from agemates.template import story_template
+
+# Dimensions of the story player
+WIDTH = 600
+HEIGHT = 450
+
+
+def progressive_enabled():
+    return bool(os.environ.get('AGEMATES_PROGRESSIVE'))
+
+
+def format_population(population):
+    if population >= 1e9:
+        return f"{population / 1e9:.1f}B"
+    elif population >= 1e6:
+        return f"{population / 1e6:.1f}M"
+    elif population >= 1e3:
+        return f"{population / 1e3:.1f}K"
+    else:
+        return str(population)
+
+
+# Marker colors of the genders; the selected gender comes first on the two-gender slide
+GENDER_COLORS = {'Male': '#4171CDFF', 'Female': '#FE34AE'}
+
+# Generations in legend order, the selected one is highlighted in SELECTED_COLOR
+GENERATIONS = ['Baby Boomer', 'Gen X', 'Millennial', 'Gen Z', 'Gen A']
+SELECTED_COLOR = '#1f4691'
+OTHER_GENERATION_COLORS = ['#03AE71FF', '#F4941BFF', '#F4C204FF', '#D49664FF']
+
+
+def gender_palette(gender):
+    male, female = GENDER_COLORS['Male'], GENDER_COLORS['Female']
+    return f'{male} {female}' if gender == 'Male' else f'{female} {male}'
+
+
+def generation_palette(generation):
+    colors = list(OTHER_GENERATION_COLORS)
+    colors.insert(GENERATIONS.index(generation), SELECTED_COLOR)
+    return ' '.join(colors)
+
+
+def slide_values(selected_year, selected_country, selected_gender, csv_path=DATA_CSV):
+    """Return the values of the variable fields of the slides (see ``agemates.template``)."""
+    schema = load_schema(csv_path)
+    cube = load_cube(csv_path)
+    generation = schema.generation(selected_year)
+
+    # Metadata of the selected country and gender, from the dimension tables
+    country = schema.country(selected_country)
+    abr_country = country['ISO3_code']
+    subregion = country['Subregion']
+    continent = country['Continent']
+    g_type = schema.g_type(selected_gender)
+
+    pop1 = cube.year_country_gender(selected_year, selected_country, selected_gender)
+    pop2 = cube.year_country(selected_year, selected_country)
+    pop3 = cube.year_subregion(selected_year, subregion)
+    pop4 = cube.year_continent(selected_year, continent)
+    pop5 = cube.year(selected_year)
+    pop6 = cube.generation(generation)
+    pop7 = cube.total()
+
+    # The selected year is highlighted by lightness; 1950 is the first bar, so the range is flipped there
+    lightness = (0, 0.4) if selected_year == 1950 else (0.4, 0)
+
+    return {
+        'year': selected_year,
+        'year_text': str(selected_year),
+        'country': selected_country,
+        'gender': selected_gender,
+        'subregion': subregion,
+        'continent': continent,
+        'generation': generation,
+        'title1': f"You Are One of {format_population(pop1)} {g_type} Born in {selected_year} in {abr_country}",
+        'title2': f"You Are One of {format_population(pop2)} People Born in {selected_year} in {abr_country}",
+        'title3': f"You Are One of {format_population(pop3)} People Born in {selected_year} in {subregion}",
+        'title4': f"You are One of {format_population(pop4)} People Born in {selected_year} in {continent}",
+        'title5': f"You Are One of {format_population(pop5)} People Born in {selected_year} in the World",
+        'title6': f"You Belong to the {format_population(pop6)} {generation}s Worldwide",
+        'title7': f"Your Generation is {(pop6 / pop7) * 100:.1f}% of People Born after 1950",
+        'title8': f"You and Your {format_population(pop5)} Age-Mates Are {(pop5 / pop7) * 100:.1f}% of People Born after 1950",
+        'gender_color': GENDER_COLORS[selected_gender],
+        'gender_palette': gender_palette(selected_gender),
+        'generation_palette': generation_palette(generation),
+        'min_lightness': lightness[0],
+        'max_lightness': lightness[1],
+    }
+
+
+def build_data(selected_year, selected_country, selected_gender, csv_path=DATA_CSV, data_url=None, first_frame=False):
+    """Return the ``ipyvizzu.Data`` of a story, only the head when the year frame is loaded from ``data_url``.
+
+    With ``first_frame`` only the rows of the first slide.
+    """
+    # Only ship the rows the slides draw: countries are summed away outside the selected year.
+    # With a data_url only the head is embedded, the player fetches the year frame itself.
+    story_data = load_story_data(csv_path)
+    if first_frame:
+        df = story_data.first_frame(selected_year, selected_country, selected_gender)
+    elif data_url is None:
+        df = story_data.frame(selected_year, selected_country, selected_gender)
+    else:
+        df = story_data.head(selected_year, selected_country, selected_gender)
+    df = with_year2(df)
+
+    # Initialize the ipyvizzu Data object
+    with span('data', rows=len(df)) as fields:
+        vizzu_data = Data()
+        vizzu_data.add_df(df)
+        fields['size'] = log_payload(vizzu_data, len(df))
+    return vizzu_data
+
+
+def build_story(selected_year, selected_country, selected_gender, csv_path=DATA_CSV, data_url=None, progressive=False,
+                values=None):
+    """Build the story of the given birth year, country and gender.
+
+    ``data_url`` is where the year frame is published (see ``agemates.assets``);
+    such a story must be rendered with the same ``data_url``. A ``progressive``
+    story only has the first slide, see ``build_html``. ``values`` are the
+    ``slide_values`` of the selection, if already computed.
+    """
+    if values is None:
+        values = slide_values(selected_year, selected_country, selected_gender, csv_path)
+
+    # Initialize the story
+    story = Story(data=build_data(selected_year, selected_country, selected_gender, csv_path, data_url, progressive))
+
+    # Set a handler that prevents showing specific elements
+
+    label_handler_method = (
+        "if(event.detail.text.split(',')[1] < 1000) event.preventDefault()"
+    )
+    story.add_event("plot-marker-label-draw", label_handler_method)
+
+    # Fill in the variable fields of the compiled slides
+    with span('slides'):
+        story['slides'] = story_template(slide_count=1 if progressive else None).slides(values)
+
+    # The backgrounds are pre-sized to the player (see agemates.backgrounds), so this is a plain blit
+    handler = """
+    if (window.storyCurrentSlide !== undefined && window.storyBgImages?.[window.storyCurrentSlide]) {
+        event.renderingContext.drawImage(window.storyBgImages[window.storyCurrentSlide], 0, 0,
+            event.detail.rect.size.x, event.detail.rect.size.y);
+        event.preventDefault();
+    }
+    """
+    story.add_event("background-draw", handler)
+
+    # Switch on the tooltip that appears when the user hovers the mouse over a chart element.
+    story.set_feature('tooltip', True)
+
+    return story
+
+
+def build_spec(selected_year, selected_country, selected_gender, csv_path=DATA_CSV, data_url=None, values=None):
+    """Return the story as a JSON slide spec: its complete data and slides, the filters as expressions.
+
+    With a ``data_url`` the data is only the head, as in ``build_data``.
+    """
+    if values is None:
+        values = slide_values(selected_year, selected_country, selected_gender, csv_path)
+    # The data as the story embeds it; Data.build() would only validate it once more
+    data = build_data(selected_year, selected_country, selected_gender, csv_path, data_url)
+    with span('slides'):
+        slides = story_template(raw_filters=False).render(values)
+    return '{"data": %s, "slides": %s}' % (json.dumps(data), slides)
+
+
+
+# Statement of the ipyvizzu-story template that hands the story over to the player
+PLAYER_DATA_STATEMENT = 'vp.slides = vizzuPlayerData;'
+
+# Loading of the published JSON assets; when one fails (the asset server is down, a 404, ...)
+# the player is replaced by an error message instead of staying blank
+FETCH_HELPERS = """const loadJson = url => fetch(url).then(response => {
+                        if (!response.ok) {
+                            throw new Error(url + ': HTTP ' + response.status);
+                        }
+                        return response.json();
+                    });
+                    const showError = error => {
+                        console.error('agemates: loading the story failed', error);
+                        const message = document.createElement('div');
+                        message.textContent = 'The story data could not be loaded, please try again later.';
+                        message.style.cssText = 'font-family: sans-serif; padding: 1em; color: #b00020;';
+                        vp.replaceWith(message);
+                    };
+                    """
+
+# Replacement that first appends the values of the published year frame to the embedded head
+FETCH_PLAYER_DATA = FETCH_HELPERS + """loadJson(%s)
+                    .then(yearFrame => {
+                        const values = Object.fromEntries(yearFrame.series.map(series => [series.name, series.values]));
+                        for (const series of vizzuPlayerData.data.series) {
+                            series.values = series.values.concat(values[series.name]);
+                        }
+                        vp.slides = vizzuPlayerData;
+                    })
+                    .catch(showError);"""
+
+# Replacement that shows the first slide, then swaps in the complete story, fetched as a JSON
+# slide spec from %s together with the year frame from %s, once the first frame is drawn
+PROGRESSIVE_PLAYER_DATA = FETCH_HELPERS + """vp.slides = vizzuPlayerData;
+                    const firstFrame = new Promise(resolve => {
+                        const shown = () => {
+                            chart.off('animation-complete', shown);
+                            performance.mark('agemates-first-frame');
+                            resolve();
+                        };
+                        chart.on('animation-complete', shown);
+                    });
+                    Promise.all([loadJson(%s), loadJson(%s), firstFrame]).then(([story, yearFrame]) => {
+                        const values = Object.fromEntries(yearFrame.series.map(series => [series.name, series.values]));
+                        for (const series of story.data.series) {
+                            series.values = series.values.concat(values[series.name]);
+                        }
+                        for (const steps of story.slides) {
+                            for (const step of steps) {
+                                if (typeof step.filter === 'string') {
+                                    step.filter = new Function('record', 'return (' + step.filter + ')');
+                                }
+                            }
+                        }
+                        vp.slides = story;
+                        performance.mark('agemates-story-complete');
+                    }).catch(showError);"""
+
+PLAYER_ID = re.compile(r'<vizzu-player id="([^"]+)"')
+
+
+def render_story(story, data_url=None, spec=None, inline=False):
+    """Return the HTML of ``story`` together with its background image loader.
+
+    ipyvizzu-story's ``_repr_html_`` is its ``to_html``, so this is also the downloadable export.
+    The backgrounds are loaded by URL (see ``background_urls``), so browsers cache them; only
+    the self-contained ``inline`` export embeds them. A progressive story is rendered with the
+    ``spec`` of the complete story (``build_spec`` with the same ``data_url``), which is
+    published as an asset, so it needs a ``data_url``.
+    """
+    with span('to_html') as fields:
+        story_html = story._repr_html_()
+        fields['size'] = len(story_html)
+    if PLAYER_DATA_STATEMENT not in story_html and (data_url is not None or spec is not None):
+        raise RuntimeError('unsupported ipyvizzu-story template, cannot load the story data by URL')
+    if spec is not None:
+        spec_url = spec_asset_url(spec.encode()) if data_url is not None else None
+        if spec_url is None:
+            raise ValueError('a progressive story fetches the rest from the published assets, it needs a data_url')
+        story_html = story_html.replace(
+            PLAYER_DATA_STATEMENT, PROGRESSIVE_PLAYER_DATA % (json.dumps(spec_url), json.dumps(data_url)))
+    elif data_url is not None:
+        story_html = story_html.replace(PLAYER_DATA_STATEMENT, FETCH_PLAYER_DATA % json.dumps(data_url))
+    backgrounds = inline_sources(WIDTH, HEIGHT) if inline else background_urls(WIDTH, HEIGHT)
+    return story_html + background_script(backgrounds)
+
+
+def build_html(selected_year, selected_country, selected_gender, csv_path=DATA_CSV, data_url=None, progressive=False,
+               inline=False):
+    """Return the rendered story of a selection, see ``build_story`` and ``render_story``."""
+    values = slide_values(selected_year, selected_country, selected_gender, csv_path)
+    story = build_story(selected_year, selected_country, selected_gender, csv_path, data_url, progressive, values)
+    spec = None
+    if progressive:
+        spec = build_spec(selected_year, selected_country, selected_gender, csv_path, data_url, values)
+    return render_story(story, data_url, spec, inline)
+
+
+def story_key(selected_year, selected_country, selected_gender, csv_path=DATA_CSV, data_url=None, progressive=False,
+              inline=False):
+    """Return the cache key of a story: the selection plus the data, code and background fingerprints."""
+    return [
+        dataset_fingerprint(csv_path), CODE_FINGERPRINT, background_fingerprint(),
+        int(selected_year), str(selected_country), str(selected_gender), data_url, bool(progressive), bool(inline),
+    ]
+
+
+def spec_key(selected_year, selected_country, selected_gender, csv_path=DATA_CSV):
+    """Return the cache key of the JSON slide spec of a story."""
+    return story_key(selected_year, selected_country, selected_gender, csv_path, progressive=False) + ['spec']
+
+
+def story_data_url(selected_year, csv_path=DATA_CSV, inline=False):
+    """Return where ``cached_story`` loads the year frame from, None when it is embedded."""
+    return None if inline else year_asset_url(selected_year, csv_path)
+
+
+def story_progressive(progressive, data_url):
+    """Return whether ``cached_story`` builds a progressive story: if asked to (by default if enabled) and possible."""
+    if progressive is None:
+        progressive = progressive_enabled()
+    return progressive and data_url is not None
+
+
+def story_cache_key(selected_year, selected_country, selected_gender, csv_path=DATA_CSV, inline=False, progressive=None):
+    """Return the key ``cached_story`` stores a story under, which covers where its data is published."""
+    data_url = story_data_url(selected_year, csv_path, inline)
+    progressive = story_progressive(progressive, data_url)
+    return story_key(selected_year, selected_country, selected_gender, csv_path, data_url, progressive, inline)
+
+
+def cached_story(selected_year, selected_country, selected_gender, csv_path=DATA_CSV, inline=False, progressive=None):
+    """Return the rendered story as UTF-8 bytes from the shared cache, building it on a miss.
+
+    Misses are served from the pre-rendered store (``AGEMATES_PRERENDER_DIR``) when it has the story.
+    The story loads its data from the published assets when they are enabled and its backgrounds
+    by URL, unless ``inline`` is set for the self-contained HTML export. Stories are
+    ``progressive`` (see ``build_html``) when ``AGEMATES_PROGRESSIVE`` is set, unless told
+    otherwise, and only with published assets; the export never is.
+    """
+    data_url = story_data_url(selected_year, csv_path, inline)
+    progressive = story_progressive(progressive, data_url)
+    key = story_key(selected_year, selected_country, selected_gender, csv_path, data_url, progressive, inline)
+    if not inline:
+        # Published before the story is served, which may come from a cache and reference them
+        background_urls(WIDTH, HEIGHT)
+
+    with span('story', inline=inline, source='cache') as fields:
+
+        def build():
+            # Prefer a story rendered offline by agemates.prerender
+            prerendered = get_prerendered()
+            story_bytes = prerendered.get(key) if prerendered else None
+            fields['source'] = 'prerendered'
+            if story_bytes is None:
+                story_bytes = build_html(
+                    selected_year, selected_country, selected_gender, csv_path, data_url, progressive, inline).encode()
+                fields['source'] = 'built'
+            return story_bytes
+
+        story_bytes = get_story_cache().get_or_build(key, build)
+        fields['size'] = len(story_bytes)
+    return story_bytes
+
+
+def cached_spec(selected_year, selected_country, selected_gender, csv_path=DATA_CSV):
+    """Return ``build_spec`` as UTF-8 bytes from the shared story cache."""
+    key = spec_key(selected_year, selected_country, selected_gender, csv_path)
+    with span('spec', source='cache') as fields:
+
+        def build():
+            fields['source'] = 'built'
+            return build_spec(selected_year, selected_country, selected_gender, csv_path).encode()
+
+        spec_bytes = get_story_cache().get_or_build(key, build)
+        fields['size'] = len(spec_bytes)
+    return spec_bytes
@@ -0,0 +1,341 @@
+"""The slides of the story as a declarative template, compiled once per process.
+
+The slides of every selection share the same structure; they only differ in
+titles, filter values, palette order and lightness range. ``STORY_TEMPLATE``
+describes the slides with ``Slot`` placeholders for those fields and with
+``{name}`` placeholders in the filter expressions. Compiling it builds the
+ipyvizzu-story objects once, serializes them and splits the JSON at the
+placeholders, so a story only costs a string join of the substituted values.
+
+The template is also compiled to a plain JSON slide spec (``raw_filters=False``)
+in which the filters are JavaScript expressions in strings instead of code, and
+to its first slide alone, which progressive stories show before the rest.
+"""
+import functools
+import json
+import re
+
+from ipyvizzu import Config, Data, RawJavaScript, RawJavaScriptEncoder, Style
+from ipyvizzustory import Slide, Step
+
+
+class Slot:
+    """Placeholder of a value in the config or style of a step."""
+
+    def __init__(self, name):
+        self.name = name
+
+
+# Shared number format of the labels
+SHORT_NUMBERS = {
+    "numberFormat": "prefixed",
+    "maxFractionDigits": "1",
+    "numberScale": "shortScaleSymbolUS",
+}
+
+COUNTRY_PALETTE = (
+    '#1f4691 #03AE71FF #F4941BFF #F4C204FF #D49664FF #F25456FF #9E67ABFF #BCA604FF #846E1CFF #FC763CFF '
+    '#B462ACFF #F492FCFF #BC4A94FF #9C7EF4FF #9C52B4FF #6CA2FCFF #5C6EBCFF #7C868CFF #AC968CFF #4C7450FF '
+    '#AC7A4CFF #7CAE54FF #4C7450FF #9C1A6CFF #AC3E94FF #B41204FF'
+)
+
+# Slides, as lists of steps. A step has an optional 'filter' (a JavaScript expression, None clears
+# the filter), 'config' and 'style'.
+STORY_TEMPLATE = [
+    # Slide 1: No. of people with the same sex, born in the same year, same country
+    [{
+        'filter': "record['Year'] == {year_text} && record['Country'] == {country} && record['Gender'] == {gender}",
+        'config': {
+            'color': 'Gender',
+            'size': 'Population',
+            'geometry': 'circle',
+            'label': 'Population',
+            'legend': None,
+            'title': Slot('title1'),
+        },
+        'style': {
+            'logo': {'width': '5em', 'filter': 'none'},
+            'title': {'fontSize': '3em'},
+            'plot': {'marker': {
+                'colorPalette': Slot('gender_color'),
+                'label': {
+                    'format': 'dimensionsFirst',
+                    'fontSize': '2.5em',
+                },
+            }},
+        },
+    }],
+    # Slide 2: both genders born in the same year, same country
+    [{
+        'filter': "record['Country'] == {country} && record['Year'] == {year_text}",
+        'config': {
+            'label': ['G_Type', 'Population'],
+            'title': Slot('title2'),
+        },
+        'style': {
+            'plot': {'marker': {
+                'colorPalette': Slot('gender_palette'),
+                'label': {
+                    'format': 'measureFirst',
+                    'fontSize': '1.8em',
+                },
+            }},
+        },
+    }],
+    # Slide 3: the countries of the subregion
+    [{
+        'filter': "record['Subregion'] == {subregion} && record['Year'] == {year}",
+        'config': {
+            'color': 'Country',
+            'label': ['ISO3_code', 'Population'],
+            'legend': None,
+            'title': Slot('title3'),
+        },
+        'style': {
+            "plot": {
+                "marker": {
+                    'colorPalette': COUNTRY_PALETTE,
+                    "label": {'format': 'dimensionsFirst', **SHORT_NUMBERS},
+                },
+            },
+        },
+    }],
+    # Slide 4: the continent
+    [{
+        'filter': "record['Continent'] == {continent} && record['Year'] == {year}",
+        'config': {
+            'title': Slot('title4'),
+            'size': ['Population'],
+        },
+    }],
+    # Slide 5: the continents of the world
+    [{
+        'filter': "record['Year'] == {year_text}",
+        'config': {
+            'color': 'Continent',
+            'label': ['Continent', 'Population'],
+            'title': Slot('title5'),
+        },
+    }],
+    # Slide 6: the selected year among all years, then the generation
+    [
+        {
+            'filter': "record['Year'] == {year_text}",
+            'config': {
+                'geometry': 'rectangle',
+                'x': 'Year2',
+                'y': ['Population', 'Continent'],
+                'label': None,
+                'title': Slot('title5'),
+            },
+        },
+        {
+            'config': {
+                'y': 'Population',
+                'color': 'Generation',
+            },
+            'style': {
+                "plot": {
+                    "marker": {
+                        'colorPalette': '#1f4691',
+                        "label": SHORT_NUMBERS,
+                    },
+                },
+            },
+        },
+        {
+            'config': {
+                'x': ['Year2', 'IsSelectedYear'],
+                'label': 'Population',
+                'lightness': 'IsSelectedYear',
+            },
+            'style': {
+                "plot": {
+                    "marker": {
+                        'minLightness': Slot('min_lightness'),
+                        'maxLightness': Slot('max_lightness'),
+                    },
+                },
+            },
+        },
+        {
+            'filter': "record['Generation'] == {generation}",
+            'config': {
+                'title': Slot('title6'),
+            },
+        },
+    ],
+    # Slide 7: the generations
+    [
+        {
+            'config': {
+                'label': None,
+                'color': 'Generation',
+                'lightness': None,
+            },
+            'style': {
+                "plot": {
+                    "marker": {
+                        'colorPalette': '#1f4691',
+                        'minLightness': 0,
+                        'maxLightness': 0,
+                    },
+                },
+            },
+        },
+        {
+            'config': {
+                'x': ['Generation', 'Population'],
+                'y': None,
+            },
+        },
+        {
+            'config': {
+                'label': 'Population',
+            },
+            'style': {
+                'plot': {'marker': {'label': {'position': 'center'}}},
+            },
+        },
+        {
+            'filter': None,
+            'config': {
+                'label': ['Generation', 'Population'],
+                'title': Slot('title7'),
+                'color': 'Generation',
+            },
+            'style': {
+                "plot": {
+                    "marker": {
+                        'colorPalette': Slot('generation_palette'),
+                    },
+                },
+            },
+        },
+    ],
+    # Slide 8: the age-mates among everyone born after 1950
+    [{
+        'filter': None,
+        'config': {
+            'label': None,
+            'x': ['Year2', 'Generation', 'Population', 'IsSelectedYear'],
+            'color': 'Generation',
+            'lightness': 'IsSelectedYear',
+            'title': Slot('title8'),
+        },
+        'style': {
+            "plot": {
+                "marker": {
+                    'minLightness': Slot('min_lightness'),
+                    'maxLightness': Slot('max_lightness'),
+                },
+            },
+        },
+    }],
+]
+
+# Placeholders in the serialized template: "@@name@@" is a JSON value, a bare @@name@@ a JavaScript literal
+_PLACEHOLDER = re.compile(r'"@@(\w+)@@"|@@(\w+)@@')
+
+
+class _Placeholders(dict):
+    # format_map mapping that turns every {name} of a filter into a bare placeholder
+    def __missing__(self, name):
+        return f'@@{name}@@'
+
+
+def _fill_slots(value):
+    if isinstance(value, Slot):
+        return f'@@{value.name}@@'
+    if isinstance(value, dict):
+        return {key: _fill_slots(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_fill_slots(item) for item in value]
+    return value
+
+
+def _spec_step(step):
+    spec = {}
+    if 'filter' in step:
+        expression = step['filter']
+        spec['filter'] = None if expression is None else expression.format_map(_Placeholders())
+    for key in ('config', 'style'):
+        if key in step:
+            spec[key] = _fill_slots(step[key])
+    return spec
+
+
+def _step(step):
+    animations = []
+    if 'filter' in step:
+        expression = step['filter']
+        animations.append(Data.filter(None if expression is None else expression.format_map(_Placeholders())))
+    if 'config' in step:
+        animations.append(Config(_fill_slots(step['config'])))
+    if 'style' in step:
+        animations.append(Style(_fill_slots(step['style'])))
+    return Step(*animations)
+
+
+def js_literal(value):
+    """Return ``value`` as a JavaScript literal for a filter expression."""
+    if isinstance(value, str):
+        return "'%s'" % value.replace('\\', '\\\\').replace("'", "\\'")
+    return str(value)
+
+
+class StoryTemplate:
+    """A compiled story template: the serialized slides split at their placeholders.
+
+    With ``raw_filters`` the filters are JavaScript functions, as the story player
+    expects them, otherwise strings holding the filter expression.
+    """
+
+    def __init__(self, template, raw_filters=True):
+        if raw_filters:
+            slides = []
+            for steps in template:
+                slide = Slide()
+                for step in steps:
+                    slide.add_step(_step(step))
+                slides.append(slide)
+        else:
+            slides = [[_spec_step(step) for step in steps] for steps in template]
+        self.raw_filters = raw_filters
+        serialized = json.dumps(slides, cls=RawJavaScriptEncoder)
+        parts = _PLACEHOLDER.split(serialized)
+        # split() yields text, JSON slot, JavaScript slot, text, ...
+        self._texts = parts[::3]
+        self._slots = [(json_name or js_name, json_name is not None)
+                       for json_name, js_name in zip(parts[1::3], parts[2::3])]
+        self.slide_count = len(slides)
+
+    @property
+    def slots(self):
+        """Return the names of the values ``render`` needs."""
+        return {name for name, _ in self._slots}
+
+    def render(self, values):
+        """Return the JSON of the slides with ``values`` substituted."""
+        pieces = [self._texts[0]]
+        for (name, is_json), text in zip(self._slots, self._texts[1:]):
+            value = values[name]
+            if is_json:
+                pieces.append(json.dumps(value))
+            elif self.raw_filters:
+                pieces.append(js_literal(value))
+            else:
+                # Inside the JSON string of a filter expression
+                pieces.append(json.dumps(js_literal(value))[1:-1])
+            pieces.append(text)
+        return ''.join(pieces)
+
+    def slides(self, values):
+        """Return the slides with ``values`` substituted, to be set as the ``slides`` of a ``Story``."""
+        return RawJavaScript(self.render(values))
+
+
+@functools.lru_cache(maxsize=None)
+def story_template(raw_filters=True, slide_count=None):
+    """Return the compiled ``STORY_TEMPLATE``, only its first ``slide_count`` slides if given."""
+    return StoryTemplate(STORY_TEMPLATE[:slide_count], raw_filters)
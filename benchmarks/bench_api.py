@@ -0,0 +1,88 @@
+"""Concurrent requests against the headless story API, called in process.
+
+Checks the responses (status, same HTML as the app, valid JSON spec, 304 on a
+matching ETag) and reports latency percentiles and throughput for cold and
+cached stories. Run from the repository root:
+
+    python benchmarks/bench_api.py --requests 400 --concurrency 50
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+from urllib.parse import urlencode
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agemates.api import create_app, request  # noqa: E402
+from agemates.story import cached_story  # noqa: E402
+
+SELECTIONS = [
+    (year, country, gender)
+    for year in (1950, 1980, 2000, 2024)
+    for country in ('Hungary', 'China', "Cote d'Ivoire", 'Brazil', 'Tuvalu')
+    for gender in ('Male', 'Female')
+]
+
+
+def story_path(year, country, gender, **params):
+    return '/story?' + urlencode(dict(year=year, country=country, gender=gender, **params))
+
+
+async def check(app):
+    status, headers, body = await request(app, story_path(*SELECTIONS[0]))
+    assert status == 200 and body == cached_story(*SELECTIONS[0]), status
+    status, _, _ = await request(app, story_path(*SELECTIONS[0]), headers=[('If-None-Match', headers['etag'])])
+    assert status == 304, status
+    status, headers, body = await request(app, story_path(*SELECTIONS[0], format='json'))
+    assert status == 200 and len(json.loads(body)['slides']) == 8, status
+    for path in [story_path(1900, 'Hungary', 'Male'), story_path(1980, 'Atlantis', 'Male'), '/story?year=x']:
+        status, _, _ = await request(app, path)
+        assert status == 400, (path, status)
+    status, _, _ = await request(app, '/nothing')
+    assert status == 404, status
+
+
+async def load(app, count, concurrency, params):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    size = 0
+
+    async def one(i):
+        nonlocal size
+        async with semaphore:
+            start = time.perf_counter()
+            status, _, body = await request(app, story_path(*SELECTIONS[i % len(SELECTIONS)], **params))
+            latencies.append((time.perf_counter() - start) * 1e3)
+            assert status == 200, status
+            size += len(body)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(count)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    quantiles = statistics.quantiles(latencies, n=100)
+    return (f'{count} requests in {elapsed:.2f} s: {count / elapsed:.0f} req/s, '
+            f'p50 {quantiles[49]:.1f} ms, p95 {quantiles[94]:.1f} ms, p99 {quantiles[98]:.1f} ms, '
+            f'{size / count / 1e3:.0f} KB/response')
+
+
+async def main(count, concurrency):
+    app = create_app()
+    print('cold html  ', await load(app, len(SELECTIONS), concurrency, {}))
+    print('cached html', await load(app, count, concurrency, {}))
+    print('cold json  ', await load(app, len(SELECTIONS), concurrency, {'format': 'json'}))
+    print('cached json', await load(app, count, concurrency, {'format': 'json'}))
+    await check(app)
+    print('checks passed')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=400)
+    parser.add_argument('--concurrency', type=int, default=50)
+    args = parser.parse_args()
+    asyncio.run(main(args.requests, args.concurrency))
@@ -0,0 +1,77 @@
+"""Throughput of cohort_statistics over every (year, country, gender), against a loop of cube lookups.
+
+The batch answers are checked against the per-selection cube lookups for every
+selection and against the original boolean masks for a sample. Run from the
+repository root:
+
+    python benchmarks/bench_cohorts.py
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agemates.aggregates import cohort_statistics, load_cube, mask_totals  # noqa: E402
+from agemates.data import load_dataset  # noqa: E402
+from agemates.schema import load_schema  # noqa: E402
+
+REPEAT = 5
+SAMPLE = 50
+
+
+def loop_statistics(cube, schema, selections):
+    # The numbers as build_story computes them, one selection at a time
+    rows = []
+    for year, country, gender in selections:
+        metadata = schema.country(country)
+        generation = schema.generation(year)
+        rows.append((
+            cube.year_country_gender(year, country, gender),
+            cube.year_country(year, country),
+            cube.year_subregion(year, metadata['Subregion']),
+            cube.year_continent(year, metadata['Continent']),
+            cube.year(year),
+            cube.generation(generation),
+            cube.total(),
+        ))
+    return rows
+
+
+def best_of(func):
+    timings = []
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def main():
+    df = load_dataset()
+    cube = load_cube()
+    schema = load_schema()
+    selections = [(year, country, gender) for year in schema.years()
+                  for country in schema.country_names() for gender in schema.gender_names()]
+    years, countries, genders = zip(*selections)
+
+    batch_time, stats = best_of(lambda: cohort_statistics(years, countries, genders))
+    loop_time, rows = best_of(lambda: loop_statistics(cube, schema, selections))
+    print(f'{len(selections)} selections')
+    print(f'cohort_statistics {batch_time * 1e3:8.1f} ms  {len(selections) / batch_time:12,.0f} selections/s')
+    print(f'loop of lookups   {loop_time * 1e3:8.1f} ms  {len(selections) / loop_time:12,.0f} selections/s')
+
+    columns = ['cohort', 'country_year', 'subregion_year', 'continent_year', 'world_year', 'generation_total', 'total']
+    batch_rows = list(stats[columns].itertuples(index=False, name=None))
+    if batch_rows != rows:
+        sys.exit('cohort_statistics differs from the cube lookups')
+    for i in range(0, len(selections), len(selections) // SAMPLE):
+        row = stats.iloc[i]
+        expected = mask_totals(df, row['year'], row['country'], row['gender'], row['subregion'], row['continent'], row['generation'])
+        if [int(value) for value in expected] != [int(row[column]) for column in columns]:
+            sys.exit(f'cohort_statistics differs from the masks for {selections[i]}')
+    print('checks passed')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+"""Stories from a synthetic dataset ``--factor`` times the rows of data.csv, with each query backend.
+
+The synthetic dataset is data.csv with every row split into ``--factor``
+sub-national regions (an extra ``Region`` column), the population spread over
+them at random but summing to the original. It is written as Parquet, chunk
+by chunk, next to nothing else in ``--out`` (a temporary directory by default).
+
+Every backend runs in its own process, for a clean peak RSS: it loads the
+dataset with the structures the story derives from it and builds
+``--stories`` stories of random selections. The arrow backend must produce
+exactly the stories that data.csv does, since the regions sum up to its rows;
+the pandas backend reads every row and is only timed. Run from the repository
+root:
+
+    python benchmarks/bench_large.py --factor 100
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from agemates.data import COLUMNS, CSV_ENCODING, DATA_CSV, DTYPES  # noqa: E402
+
+# Rows of data.csv split at once while writing the synthetic dataset
+CHUNK_ROWS = 2000
+
+
+def generate(path, factor, seed):
+    """Write data.csv with every row split into ``factor`` regions to the Parquet file ``path``."""
+    import numpy as np
+    import pandas as pd
+    import pyarrow as pa
+    import pyarrow.parquet as parquet
+
+    source = pd.read_csv(DATA_CSV, encoding=CSV_ENCODING, usecols=COLUMNS, dtype=DTYPES)[COLUMNS]
+    rng = np.random.default_rng(seed)
+    regions = np.array([f'R{i:03d}' for i in range(factor)], dtype=object)
+    writer = None
+    try:
+        for start in range(0, len(source), CHUNK_ROWS):
+            chunk = source.iloc[start:start + CHUNK_ROWS]
+            shares = rng.dirichlet(np.ones(factor), size=len(chunk))
+            populations = rng.multinomial(chunk['Population'].to_numpy(dtype='int64'), shares)
+            rows = chunk.loc[chunk.index.repeat(factor)].reset_index(drop=True)
+            rows['Population'] = populations.reshape(-1).astype('int32')
+            rows.insert(COLUMNS.index('Country') + 1, 'Region', np.tile(regions, len(chunk)))
+            table = pa.Table.from_pandas(rows, preserve_index=False)
+            if writer is None:
+                writer = parquet.ParquetWriter(path, table.schema)
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def selections(schema, count, seed):
+    rng = random.Random(seed)
+    years, countries, genders = list(schema.years()), schema.country_names(), schema.gender_names()
+    return [(rng.choice(years), rng.choice(countries), rng.choice(genders)) for _ in range(count)]
+
+
+def child(path, stories, seed):
+    """Load ``path`` with the backend of AGEMATES_BACKEND, build stories and print the results as JSON."""
+    from agemates.aggregates import load_cube
+    from agemates.data import dataset_backend, load_dataset
+    from agemates.payload import load_story_data
+    from agemates.schema import load_schema
+    from agemates.story import PLAYER_ID, build_html
+
+    start = time.perf_counter()
+    rows = len(load_dataset(path))
+    schema = load_schema(path)
+    load_cube(path)
+    load_story_data(path)
+    load_seconds = time.perf_counter() - start
+
+    build_ms, sizes, digest = [], [], hashlib.sha256()
+    for selection in selections(schema, stories, seed):
+        start = time.perf_counter()
+        story = build_html(*selection, path)
+        build_ms.append((time.perf_counter() - start) * 1e3)
+        sizes.append(len(story))
+        # The player id is random, everything else must match
+        digest.update(story.replace(PLAYER_ID.search(story).group(1), '').encode())
+    print(json.dumps({
+        'backend': dataset_backend(path),
+        'rows': rows,
+        'load_seconds': load_seconds,
+        'build_ms': statistics.median(build_ms),
+        'story_bytes': statistics.median(sizes),
+        # ru_maxrss is in KB on Linux
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'stories': digest.hexdigest(),
+    }))
+
+
+def run_child(backend, path, args):
+    env = dict(os.environ, AGEMATES_BACKEND=backend, AGEMATES_RELOAD_INTERVAL='0')
+    output = subprocess.run(
+        [sys.executable, __file__, '--child', path, '--stories', str(args.stories), '--seed', str(args.seed)],
+        env=env, capture_output=True, text=True, check=True,
+    ).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--factor', type=int, default=100, help='rows per row of data.csv (default: %(default)s)')
+    parser.add_argument('--stories', type=int, default=20, help='stories built per backend (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', help='directory of the synthetic dataset, reused if it is there (default: temporary)')
+    parser.add_argument('--skip-pandas', action='store_true', help='do not load the synthetic dataset with pandas')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        child(args.child, args.stories, args.seed)
+        return
+
+    directory = args.out or tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, f'synthetic-{args.factor}x.parquet')
+        if not os.path.exists(path):
+            start = time.perf_counter()
+            os.makedirs(directory, exist_ok=True)
+            generate(path, args.factor, args.seed)
+            print(f'wrote {path}: {os.path.getsize(path) / 2**20:.0f} MB in {time.perf_counter() - start:.1f} s')
+
+        runs = [('data.csv', run_child('pandas', DATA_CSV, args))]
+        runs.append((f'{args.factor}x', run_child('arrow', path, args)))
+        if not args.skip_pandas:
+            runs.append((f'{args.factor}x', run_child('pandas', path, args)))
+        for name, result in runs:
+            print(f'{name:9} {result["backend"]:6} {result["rows"]:>9} rows in memory, loaded in '
+                  f'{result["load_seconds"]:6.2f} s, story {result["build_ms"]:7.1f} ms '
+                  f'{result["story_bytes"] / 1e3:7.0f} KB, peak RSS {result["peak_rss_mb"]:6.0f} MB')
+    finally:
+        if not args.out:
+            shutil.rmtree(directory)
+
+    if runs[1][1]['stories'] != runs[0][1]['stories']:
+        sys.exit('the arrow backend built other stories than data.csv')
+    print('checks passed')
+
+
+if __name__ == '__main__':
+    main()
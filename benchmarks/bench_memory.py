@@ -0,0 +1,129 @@
+"""Per-session memory: RSS growth over N simulated concurrent sessions, before and after.
+
+Each mode runs in a fresh interpreter:
+
+- legacy: what every rerun of the original script held, its own object-dtype
+  parse of data.csv plus the derived, sorted copy and its ipyvizzu data;
+- current: what a rerun holds now, the 75-row head and the cached story bytes
+  over the shared, category-encoded dataset;
+- apptest: real app sessions driven by Streamlit's AppTest, each after a click.
+
+Sessions use distinct selections, so the current modes also fill the (bounded)
+story cache; its size is reported separately. The shared dataset is checked
+to be unchanged afterwards. Run from the repository root:
+
+    python benchmarks/bench_memory.py --sessions 50
+"""
+import argparse
+import gc
+import json
+import os
+import resource
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import pandas as pd  # noqa: E402
+
+from agemates.cache import get_story_cache  # noqa: E402
+from agemates.data import CSV_ENCODING, DATA_CSV, load_dataset  # noqa: E402
+from agemates.payload import load_story_data, vizzu_data  # noqa: E402
+from agemates.story import cached_story  # noqa: E402
+from bench_selection import legacy_view  # noqa: E402
+
+MODES = ['legacy', 'current', 'apptest']
+
+YEARS = [1950, 1965, 1980, 1995, 2010, 2024]
+COUNTRIES = ['China', 'Hungary', 'Brazil', 'Nigeria', 'India', 'Tuvalu', 'Germany', 'Japan', 'Mexico']
+GENDERS = ['Male', 'Female']
+
+
+def rss_mb():
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except OSError:  # not Linux, fall back to the peak
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss / 2**20 if sys.platform == 'darwin' else maxrss / 2**10
+
+
+def selection(i):
+    return YEARS[i % len(YEARS)], COUNTRIES[i // len(YEARS) % len(COUNTRIES)], GENDERS[i // 54 % 2]
+
+
+def legacy_session(i):
+    year, country, gender = selection(i)
+    df = pd.read_csv(DATA_CSV, encoding=CSV_ENCODING)
+    df = legacy_view(df, year, country, gender)
+    df['Year2'] = df['Year'].astype(str)
+    return df, vizzu_data(df)
+
+
+def current_session(i):
+    year, country, gender = selection(i)
+    return load_story_data().head(year, country, gender), cached_story(year, country, gender)
+
+
+def apptest_session(i):
+    from streamlit.testing.v1 import AppTest
+
+    year, country, gender = selection(i)
+    at = AppTest.from_file(os.path.join(ROOT, 'age-mates.py'), default_timeout=120)
+    at.run()
+    at.number_input[0].set_value(year)
+    at.selectbox[0].set_value(country)
+    at.radio[0].set_value(gender)
+    at.run()
+    at.button[0].click().run()
+    if at.exception:
+        raise RuntimeError(at.exception[0].message)
+    return at
+
+
+def worker(mode, sessions):
+    session = {'legacy': legacy_session, 'current': current_session, 'apptest': apptest_session}[mode]
+    df = load_dataset()
+    checksum = pd.util.hash_pandas_object(df).sum()
+    # The first session pays for imports, parsing and the process-wide structures
+    held = [session(0)]
+    gc.collect()
+    first = rss_mb()
+    held += [session(i) for i in range(1, sessions)]
+    gc.collect()
+    last = rss_mb()
+    if pd.util.hash_pandas_object(load_dataset()).sum() != checksum or list(load_dataset().columns) != list(df.columns):
+        raise RuntimeError('the shared dataset was modified')
+    return {
+        'mode': mode,
+        'sessions': len(held),
+        'first_mb': first,
+        'last_mb': last,
+        'per_session_kb': (last - first) * 1024 / max(1, sessions - 1),
+        'story_cache_mb': get_story_cache().stats()['bytes'] / 2**20,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sessions', type=int, default=50)
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=MODES)
+    parser.add_argument('--worker', choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(worker(args.worker, args.sessions)))
+        return
+    for mode in args.modes:
+        output = subprocess.run(
+            [sys.executable, __file__, '--worker', mode, '--sessions', str(args.sessions)],
+            check=True, capture_output=True, text=True,
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f'{mode:8} {result["sessions"]} sessions: RSS {result["first_mb"]:7.1f} -> {result["last_mb"]:7.1f} MB, '
+              f'{result["per_session_kb"]:8.1f} KB per session (story cache {result["story_cache_mb"]:.1f} MB)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""Story data size of the full frame and of StoryData, with a check that every slide draws the same markers.
+
+Run from the repository root:
+
+    python benchmarks/bench_payload.py
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agemates.data import load_dataset  # noqa: E402
+from agemates.payload import StoryData, payload_bytes, vizzu_data, with_year2  # noqa: E402
+from agemates.selection import SelectionIndex  # noqa: E402
+
+SELECTIONS = [(1980, 'Hungary', 'Female'), (1950, 'United States of America', 'Male'), (2024, 'Afghanistan', 'Male')]
+
+DIMENSIONS = ['Year2', 'ISO3_code', 'Country', 'Subregion', 'Continent', 'Gender', 'G_Type', 'Generation', 'IsSelectedYear']
+
+
+def slide_markers(df, year, country, gender):
+    # (filter, dimensions on the channels) of every distinct chart state of the story
+    row = df.drop_duplicates('Country').set_index('Country').loc[country]
+    in_year = df['Year'] == year
+    in_country = df['Country'] == country
+    everything = df['Year'] > 0
+    return [
+        (in_year & in_country & (df['Gender'] == gender), ['Gender']),
+        (in_year & in_country, ['Gender', 'G_Type']),
+        (in_year & (df['Subregion'] == row['Subregion']), ['Country', 'ISO3_code']),
+        (in_year & (df['Continent'] == row['Continent']), ['Country', 'ISO3_code']),
+        (in_year, ['Continent']),
+        (in_year, ['Year2', 'Continent']),
+        (in_year, ['Year2', 'Generation', 'IsSelectedYear']),
+        (df['Generation'] == row['Generation'], ['Year2', 'Generation', 'IsSelectedYear']),
+        (everything, ['Generation']),
+        (everything, ['Year2', 'Generation', 'IsSelectedYear']),
+    ]
+
+
+def markers(df, year, country, gender):
+    result = []
+    for mask, dimensions in slide_markers(df, year, country, gender):
+        totals = df[mask].groupby(dimensions, observed=True)['Population'].sum()
+        result.append({key: int(value) for key, value in totals.items()})
+    return result
+
+
+def category_order(df):
+    return {column: list(df[column].astype(str).drop_duplicates()) for column in DIMENSIONS}
+
+
+def same_order(view, reduced):
+    # The blanked aggregate rows may only add a trailing '' category
+    for column, order in category_order(reduced).items():
+        expected = category_order(view)[column]
+        if order != expected and order != expected + ['']:
+            return False
+    return True
+
+
+def main():
+    df = load_dataset()
+    index = SelectionIndex(df)
+    story_data = StoryData(df)
+    for selection in SELECTIONS:
+        view = with_year2(index.view(*selection))
+        reduced = with_year2(story_data.frame(*selection))
+        if markers(view, *selection) != markers(reduced, *selection):
+            sys.exit(f'markers differ for {selection}')
+        if not same_order(view, reduced):
+            sys.exit(f'category order differs for {selection}')
+        before = payload_bytes(vizzu_data(view))
+        after = payload_bytes(vizzu_data(reduced))
+        head = payload_bytes(vizzu_data(with_year2(story_data.head(*selection))))
+        print(f'{selection}: {len(view)} rows {before / 1e6:.2f} MB -> '
+              f'{len(reduced)} rows {after / 1e6:.2f} MB ({before / after:.1f}x smaller), '
+              f'{head / 1e3:.1f} KB embedded when the year frame is a static asset')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+"""Rerun cost of laying out the dataset for a selection, before and after SelectionIndex.
+
+Run from the repository root:
+
+    python benchmarks/bench_selection.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agemates.data import load_dataset  # noqa: E402
+from agemates.selection import SelectionIndex  # noqa: E402
+
+SELECTIONS = [(1980, 'Hungary', 'Female'), (1950, 'United States of America', 'Male'), (2024, 'Afghanistan', 'Male')]
+REPEAT = 5
+
+
+def legacy_view(df, year, country, gender):
+    # The per-rerun derivation age-mates.py used to do
+    df = df.assign(IsSelectedYear=df['Year'].apply(lambda x: 'yes' if x == year else 'no'))
+    df['MatchCriteria'] = df.apply(lambda row: 'yes' if (row['Country'] == country and row['Gender'] == gender) else 'no', axis=1)
+    df = df.sort_values(by=['MatchCriteria', 'Year'], ascending=[False, True])
+    return df.drop(columns=['MatchCriteria'])
+
+
+def best_of(func, number):
+    return min(timeit.repeat(func, number=number, repeat=REPEAT)) / number
+
+
+def main():
+    df = load_dataset()
+    build = best_of(lambda: SelectionIndex(df), 3)
+    index = SelectionIndex(df)
+    print(f'SelectionIndex build (once per process): {build * 1e3:8.2f} ms')
+    for selection in SELECTIONS:
+        if not legacy_view(df, *selection).equals(index.view(*selection)):
+            sys.exit(f'views differ for {selection}')
+        before = best_of(lambda: legacy_view(df, *selection), 1)
+        after = best_of(lambda: index.view(*selection), 20)
+        print(f'{selection}: legacy {before * 1e3:8.2f} ms, view {after * 1e3:6.2f} ms, {before / after:6.1f}x faster')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""Click-to-chart latency with and without speculative story builds.
+
+A simulated user settles on a selection, thinks for a while and presses
+"Create Story". Without speculation the click builds the story; with it the
+selection was handed to ``SpeculativeBuilds`` when the inputs changed, so the
+click finds the story cached or waits for the build in flight. A fickle user
+changes the selection three times in quick succession before thinking; only
+the last selection should be built. Every measurement uses a story that is not
+cached yet. Run from the repository root:
+
+    python benchmarks/bench_speculative.py --delay 0.3
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agemates.schema import load_schema  # noqa: E402
+from agemates.speculative import SpeculativeBuilds  # noqa: E402
+from agemates.story import cached_story  # noqa: E402
+
+THINK_SECONDS = [0, 0.1, 0.3, 0.5, 1.0]
+
+# Seconds between the changes of a fickle user
+FICKLE_SECONDS = 0.05
+
+
+def fresh_selections(seed):
+    schema = load_schema()
+    selections = [(year, country, gender) for year in schema.years()
+                  for country in schema.country_names() for gender in schema.gender_names()]
+    random.Random(seed).shuffle(selections)
+    return iter(selections)
+
+
+def click(selection):
+    start = time.perf_counter()
+    cached_story(*selection)
+    return (time.perf_counter() - start) * 1e3
+
+
+def run(builds, selections, think, samples, fickle):
+    plain, speculative, states = [], [], []
+    for i in range(samples):
+        selection = next(selections)
+        time.sleep(think)
+        plain.append(click(selection))
+
+        session = f'user-{think}-{i}'
+        for _ in range(2 if fickle else 0):
+            builds.submit(session, next(selections), lambda selection=selection: None)
+            time.sleep(FICKLE_SECONDS)
+        selection = next(selections)
+        builds.submit(session, selection, lambda selection=selection: cached_story(*selection))
+        time.sleep(think)
+        job = builds.job(session)
+        states.append(job.state if job is not None else 'done')
+        builds.cancel(session)
+        speculative.append(click(selection))
+    return plain, speculative, states
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--samples', type=int, default=10, help='clicks per think time (default: %(default)s)')
+    parser.add_argument('--delay', type=float, default=0.3, help='settle delay of the builds (default: %(default)s)')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    selections = fresh_selections(args.seed)
+    # Parsing and the shared structures are paid once per process, before any click
+    click(next(selections))
+
+    for fickle in (False, True):
+        builds = SpeculativeBuilds(args.workers, delay=args.delay)
+        print('fickle user' if fickle else 'settled user')
+        for think in THINK_SECONDS:
+            plain, speculative, states = run(builds, selections, think, args.samples, fickle)
+            print(f'  think {think:4.1f} s: click-to-chart median {statistics.median(plain):6.1f} ms plain, '
+                  f'{statistics.median(speculative):6.1f} ms speculative '
+                  f'(at click: {", ".join(f"{states.count(state)} {state}" for state in sorted(set(states)))})')
+        print(f'  builds: {dict(sorted(builds.counters.items()))}')
+
+
+if __name__ == '__main__':
+    main()
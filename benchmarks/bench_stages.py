@@ -0,0 +1,227 @@
+"""Rerun latency of age-mates.py, stage by stage, with machine-readable baselines.
+
+Every stage of a "Create Story" rerun is timed on its own over a matrix of
+years, countries and both genders, then whole reruns are driven headlessly
+through Streamlit's AppTest (no server, no network), once with a cold and
+once with a warm story cache. The story size of every selection is recorded
+as well.
+
+First slide: the player data a progressive story embeds for its first slide
+(``first_slide`` builds it) is sized and, when node is installed, evaluated by
+V8 (``first_slide_js``), next to the player data of the complete story
+(``full_js``). That is only the cost of the literal, not a time to first
+paint, which takes a browser: there a progressive story sets the
+``agemates-first-frame`` and ``agemates-story-complete`` performance marks.
+
+    python benchmarks/bench_stages.py --output results.json
+    python benchmarks/bench_stages.py --save-baseline
+    python benchmarks/bench_stages.py --compare benchmarks/baseline.json
+
+``--compare`` exits with status 1 when a stage got slower than the baseline by
+more than ``--threshold`` (default 20%) or a story got bigger. Baselines are
+machine-specific, record them on the machine that compares against them.
+"""
+import argparse
+import json
+import os
+import platform
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import pandas as pd  # noqa: E402
+from streamlit.testing.v1 import AppTest  # noqa: E402
+
+from agemates.cache import get_story_cache  # noqa: E402
+from agemates.data import DATA_CSV, load_dataset, read_dataset  # noqa: E402
+from agemates.payload import StoryData, load_story_data  # noqa: E402
+from agemates.story import build_story, render_story  # noqa: E402
+
+APP = os.path.join(ROOT, 'age-mates.py')
+BASELINE = os.path.join(ROOT, 'benchmarks', 'baseline.json')
+
+YEARS = [1950, 1980, 2000, 2024]
+COUNTRIES = ['China', 'United States of America', 'Hungary', 'Nigeria', 'Brazil', 'Tuvalu']
+GENDERS = ['Male', 'Female']
+
+# Stages within this many milliseconds of the baseline are never flagged, they are noise
+MIN_DELTA_MS = 1.0
+
+PLAYER_DATA = re.compile(r'const vizzuPlayerData = (.*?);\n')
+
+NODE = shutil.which('node')
+
+# Evaluates a player data literal like the story's script does before the player gets it
+EVALUATE_JS = """
+const source = require('fs').readFileSync(0, 'utf8');
+const samples = [];
+for (let i = 0; i < %d; i++) {
+    const start = performance.now();
+    new Function('return ' + source)();
+    samples.push(performance.now() - start);
+}
+console.log(JSON.stringify(samples));
+"""
+
+
+def selections(quick):
+    years = YEARS[1:2] if quick else YEARS
+    countries = COUNTRIES[:2] if quick else COUNTRIES
+    return [(year, country, gender) for year in years for country in countries for gender in GENDERS]
+
+
+def timed(func, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1e3)
+    return samples
+
+
+def summary(samples):
+    samples = sorted(samples)
+    return {
+        'median_ms': statistics.median(samples),
+        'p90_ms': samples[min(len(samples) - 1, int(len(samples) * 0.9))],
+        'samples': len(samples),
+    }
+
+
+def player_data(story_html):
+    return PLAYER_DATA.search(story_html).group(1)
+
+
+def evaluate_js(literal, repeat):
+    output = subprocess.run([NODE, '-e', EVALUATE_JS % repeat], input=literal, capture_output=True, text=True, check=True)
+    return json.loads(output.stdout)
+
+
+def app_rerun(selection, cold):
+    at = AppTest.from_file(APP, default_timeout=120)
+    at.run()
+    year, country, gender = selection
+    at.number_input[0].set_value(year)
+    at.selectbox[0].set_value(country)
+    at.radio[0].set_value(gender)
+    at.run()
+    if cold:
+        get_story_cache().clear()
+    start = time.perf_counter()
+    at.button[0].click().run()
+    elapsed = (time.perf_counter() - start) * 1e3
+    if at.exception:
+        raise RuntimeError(f'{selection}: {at.exception[0].message}')
+    return elapsed
+
+
+def run(repeat, quick):
+    matrix = selections(quick)
+    df = load_dataset()
+    story_data = load_story_data()
+    stages = ['csv_load', 'index', 'derive', 'order', 'slides', 'serialize', 'first_slide', 'rerun_cold', 'rerun_warm']
+    if NODE:
+        stages += ['first_slide_js', 'full_js']
+    samples = {name: [] for name in stages}
+    payload = {}
+    first_slide = {}
+
+    samples['csv_load'] = timed(lambda: read_dataset(DATA_CSV), repeat)
+    samples['index'] = timed(lambda: StoryData(df), repeat)
+    for selection in matrix:
+        year = selection[0]
+        # IsSelectedYear and the selection rows (was the apply/MatchCriteria derivation)
+        samples['derive'] += timed(lambda: story_data.head(*selection), repeat)
+        # The selection-independent, ordered and aggregated rows (was the sort), uncached
+        fresh = [StoryData(df) for _ in range(repeat)]
+        samples['order'] += timed(lambda: fresh.pop().year_frame(year), repeat)
+        samples['slides'] += timed(lambda: build_story(*selection), repeat)
+        story = build_story(*selection)
+        samples['serialize'] += timed(lambda: render_story(story), repeat)
+        story_html = render_story(story)
+        payload[' | '.join(map(str, selection))] = len(story_html.encode())
+        # The rest of a progressive story is published as an asset, see agemates.story
+        samples['first_slide'] += timed(lambda: render_story(build_story(*selection, progressive=True)), repeat)
+        first_slide_data = player_data(render_story(build_story(*selection, progressive=True)))
+        first_slide[' | '.join(map(str, selection))] = len(first_slide_data.encode())
+        if NODE:
+            samples['first_slide_js'] += evaluate_js(first_slide_data, repeat)
+            samples['full_js'] += evaluate_js(player_data(story_html), repeat)
+        samples['rerun_cold'].append(app_rerun(selection, cold=True))
+        samples['rerun_warm'].append(app_rerun(selection, cold=False))
+
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'machine': platform.machine(),
+            'node': platform.node(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'selections': len(matrix),
+            'repeat': repeat,
+        },
+        'stages': {name: summary(values) for name, values in samples.items()},
+        'payload_bytes': payload,
+        'first_slide_bytes': first_slide,
+    }
+
+
+def compare(results, baseline, threshold):
+    """Return human-readable regressions of ``results`` against ``baseline``."""
+    regressions = []
+    for name, stage in results['stages'].items():
+        before = baseline['stages'].get(name)
+        if before is None:
+            continue
+        now, then = stage['median_ms'], before['median_ms']
+        if now > then * (1 + threshold) and now - then > MIN_DELTA_MS:
+            regressions.append(f'{name}: {then:.2f} ms -> {now:.2f} ms (+{(now / then - 1) * 100:.0f}%)')
+    for sizes in ['payload_bytes', 'first_slide_bytes']:
+        for selection, size in results.get(sizes, {}).items():
+            before = baseline.get(sizes, {}).get(selection)
+            if before is not None and size > before:
+                regressions.append(f'{sizes} {selection}: {before} -> {size} bytes')
+    return regressions
+
+
+def report(results):
+    for name, stage in results['stages'].items():
+        print(f'{name:12} median {stage["median_ms"]:9.2f} ms  p90 {stage["p90_ms"]:9.2f} ms  ({stage["samples"]} samples)')
+    sizes = list(results['payload_bytes'].values())
+    print(f'story size   min {min(sizes)} B  max {max(sizes)} B')
+    sizes = list(results['first_slide_bytes'].values())
+    print(f'first slide  min {min(sizes)} B  max {max(sizes)} B of player data')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5, help='timings per stage and selection (default: %(default)s)')
+    parser.add_argument('--quick', action='store_true', help='only a few selections')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--save-baseline', action='store_true', help=f'write the results to {os.path.relpath(BASELINE, ROOT)}')
+    parser.add_argument('--compare', metavar='BASELINE', help='flag regressions against this results file')
+    parser.add_argument('--threshold', type=float, default=0.2, help='tolerated slowdown (default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    results = run(args.repeat, args.quick)
+    report(results)
+    for path in filter(None, [args.output, BASELINE if args.save_baseline else None]):
+        with open(path, 'w', encoding='utf8') as file:
+            json.dump(results, file, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare, encoding='utf8') as file:
+            regressions = compare(results, json.load(file), args.threshold)
+        for regression in regressions:
+            print('REGRESSION', regression)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
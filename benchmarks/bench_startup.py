@@ -0,0 +1,151 @@
+"""Cold start of a new process: import time and time to the first widget.
+
+Imports: every measurement is a fresh interpreter importing the modules that
+age-mates.py imports at the top (read from the script), next to Streamlit
+alone and to the story modules, which are deferred to the background warm-up
+and the first story. The check fails if the page imports pull in pandas or
+ipyvizzu.
+
+First widget: every run starts a new ``streamlit run age-mates.py`` server,
+opens one session and reports how long the server took to answer its health
+check, the session to get its first input widget (from connecting) and the
+page run to finish, and how long a "Create Story" takes after the user looked
+at the form for ``--think`` seconds. ``--no-snapshot`` runs the app on a copy
+of data.csv without its metadata snapshot, the first start of a dataset nobody
+built. Run from the repository root:
+
+    python benchmarks/bench_startup.py --runs 5
+"""
+import argparse
+import ast
+import asyncio
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from tornado.websocket import websocket_connect  # noqa: E402
+
+from load_test import APP, Session, start_server  # noqa: E402
+
+# Imported when a story is built, never for the first paint
+HEAVY = ['pandas', 'numpy', 'pyarrow', 'ipyvizzu', 'ipyvizzustory', 'IPython']
+
+IMPORT_SCRIPT = '''
+import sys, time
+start = time.perf_counter()
+for module in sys.argv[1:]:
+    __import__(module)
+print(time.perf_counter() - start)
+print(' '.join(name for name in {heavy!r} if name in sys.modules))
+'''.format(heavy=HEAVY)
+
+
+def page_imports(path=APP):
+    """Return the modules the script at ``path`` imports at the top level."""
+    with open(path, encoding='utf8') as file:
+        tree = ast.parse(file.read())
+    modules = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            modules += [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom):
+            modules.append(node.module)
+    return modules
+
+
+def time_imports(modules, runs):
+    """Return the median seconds a fresh interpreter takes to import ``modules``, and the heavy modules loaded."""
+    seconds = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', IMPORT_SCRIPT, *modules], cwd=ROOT,
+                                capture_output=True, text=True, check=True).stdout.splitlines()
+        seconds.append(float(output[0]))
+        loaded = output[1].split() if len(output) > 1 else []
+    return statistics.median(seconds), loaded
+
+
+class FirstPaint(Session):
+    """A session that also notes when the first input widget arrived."""
+
+    first_widget = None
+
+    def _element(self, delta):
+        super()._element(delta)
+        if self.first_widget is None and self.widgets:
+            self.first_widget = time.perf_counter()
+
+
+async def first_session(url, think):
+    session = FirstPaint(url, [], 0, 0)
+    start = time.perf_counter()
+    connection = await websocket_connect(session.url, max_message_size=64 * 2**20)
+    try:
+        await session._rerun('load', connection)
+        await asyncio.sleep(think)
+        await session._rerun('create', connection, session.widgets['button'], trigger=True)
+    finally:
+        connection.close()
+    return {
+        'first widget': (session.first_widget - start) * 1e3,
+        'page done': session.latencies['load'][0],
+        'first story': session.latencies['create'][0],
+    }
+
+
+def cold_start(think, snapshot):
+    directory = None
+    cwd = ROOT
+    if not snapshot:
+        directory = tempfile.mkdtemp()
+        shutil.copy(os.path.join(ROOT, 'data.csv'), directory)
+        cwd = directory
+    try:
+        start = time.perf_counter()
+        server, url = start_server(cwd)
+        up = (time.perf_counter() - start) * 1e3
+        try:
+            return {'server up': up, **asyncio.run(first_session(url, think))}
+        finally:
+            server.terminate()
+            server.wait()
+    finally:
+        if directory:
+            shutil.rmtree(directory)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5, help='cold starts and import measurements (default: %(default)s)')
+    parser.add_argument('--think', type=float, default=2.0,
+                        help='seconds between the first paint and "Create Story" (default: %(default)s)')
+    parser.add_argument('--no-snapshot', action='store_true', help='start without the metadata snapshot')
+    args = parser.parse_args(argv)
+
+    modules = page_imports()
+    leaked = []
+    for name, group in [('streamlit', ['streamlit']), ('page imports', modules), ('story modules', ['agemates.story'])]:
+        seconds, loaded = time_imports(group, args.runs)
+        print(f'import {name:14} {seconds * 1e3:7.1f} ms  heavy: {", ".join(loaded) or "none"}')
+        if name == 'page imports':
+            leaked = loaded
+
+    runs = [cold_start(args.think, not args.no_snapshot) for _ in range(args.runs)]
+    print(f'cold start, {"without" if args.no_snapshot else "with"} metadata snapshot, '
+          f'story after {args.think:.1f} s (median of {args.runs})')
+    for stage in runs[0]:
+        print(f'  {stage:12} {statistics.median(run[stage] for run in runs):7.1f} ms')
+
+    if leaked:
+        sys.exit(f'the page imports load {", ".join(leaked)}')
+    print('checks passed')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""The headline totals of the cube against the original boolean masks.
+
+Checks ``--sample`` random selections, plus the first and last year, with
+``check_cube``: once for the cube grouped from data.csv and once for the cube
+loaded from the aggregate tables of a fresh ``agemates.build`` of it in a
+temporary directory. Exits non-zero on any mismatch. Run from the repository
+root:
+
+    python benchmarks/check_cube.py --sample 200
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agemates.aggregates import PopulationCube, check_cube, load_cube  # noqa: E402
+from agemates.build import build  # noqa: E402
+from agemates.data import DATA_CSV, get_snapshot, load_dataset  # noqa: E402
+from agemates.schema import load_schema  # noqa: E402
+
+
+def sample_selections(schema, count, seed):
+    """Return ``count`` random selections and the extreme years, as ``check_cube`` takes them."""
+    rng = random.Random(seed)
+    years, countries, genders = list(schema.years()), schema.country_names(), schema.gender_names()
+    picked = [(rng.choice(years), rng.choice(countries), rng.choice(genders)) for _ in range(count)]
+    picked += [(years[0], countries[0], genders[0]), (years[-1], countries[-1], genders[-1])]
+    selections = []
+    for year, country, gender in picked:
+        metadata = schema.country(country)
+        selections.append((year, country, gender, metadata['Subregion'], metadata['Continent'], schema.generation(year)))
+    return selections
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sample', type=int, default=200, help='random selections checked (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    df = load_dataset()
+    selections = sample_selections(load_schema(), args.sample, args.seed)
+    failed = False
+
+    directory = tempfile.mkdtemp()
+    try:
+        build([DATA_CSV], directory, log=lambda message: None)
+        csv_path = os.path.join(directory, 'data.csv')
+        built = load_cube(csv_path)
+        if get_snapshot(csv_path).read_built('aggregates/year.parquet') is None:
+            sys.exit('the build was not verified, the cube would not be loaded from its tables')
+        for name, cube in [('grouped', PopulationCube(df)), ('built', built)]:
+            mismatches = check_cube(df, cube, selections)
+            print(f'{name:8} cube: {len(selections)} selections, {len(mismatches)} mismatches')
+            for selection in mismatches[:10]:
+                print(f'  {selection}', file=sys.stderr)
+            failed = failed or bool(mismatches)
+    finally:
+        shutil.rmtree(directory)
+
+    if failed:
+        sys.exit('the cube differs from the boolean masks')
+    print('checks passed')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""Which stages of age-mates.py run for each interaction, and how long each interaction takes.
+
+The inputs and the story live in a fragment, so changing an input or pressing
+"Create Story" must not rerun the page around it, and an input change must
+not touch the story pipeline. The page itself is painted from the metadata
+snapshot, the data is loaded in the background (agemates.startup). The stages that ran are read from
+the timing spans (agemates.metrics).
+
+AppTest always reruns the whole script. ``FragmentReruns`` makes it keep the
+fragments between runs and, like the browser does for a widget inside a
+fragment, request a rerun of just the fragment. Run from the repository root:
+
+    python benchmarks/check_fragments.py
+"""
+import os
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import streamlit.testing.v1.local_script_runner as local_script_runner  # noqa: E402
+from streamlit.runtime.fragment import MemoryFragmentStorage  # noqa: E402
+from streamlit.runtime.scriptrunner.script_requests import RerunData  # noqa: E402
+from streamlit.testing.v1 import AppTest  # noqa: E402
+
+from agemates.metrics import stage_totals  # noqa: E402
+
+BUILD_STAGES = {'derive', 'order', 'data', 'slides', 'to_html'}
+
+
+class FragmentReruns:
+    """Patches AppTest's script runner to share fragments across runs and to rerun ``fragment_ids`` only."""
+
+    def __init__(self):
+        self.fragment_ids = []
+        reruns = self
+
+        class Storage(MemoryFragmentStorage):
+            def set(self, key, value):
+                super().set(key, value)
+                if key not in reruns.known:
+                    reruns.known.append(key)
+
+            def clear(self):
+                super().clear()
+                reruns.known.clear()
+
+        self.known = []
+        self.storage = Storage()
+
+    def __enter__(self):
+        self._saved = local_script_runner.MemoryFragmentStorage, local_script_runner.RerunData
+        local_script_runner.MemoryFragmentStorage = lambda: self.storage
+        local_script_runner.RerunData = lambda **kwargs: RerunData(fragment_id_queue=list(self.fragment_ids), **kwargs)
+        return self
+
+    def __exit__(self, *exc_info):
+        local_script_runner.MemoryFragmentStorage, local_script_runner.RerunData = self._saved
+
+
+def stages_of(interaction):
+    # Stages with a span recorded during interaction(), and its duration
+    before = stage_totals()
+    start = time.perf_counter()
+    at = interaction()
+    elapsed = (time.perf_counter() - start) * 1e3
+    if at.exception:
+        raise RuntimeError(at.exception[0].message)
+    after = stage_totals()
+    return {stage for stage, totals in after.items() if totals[0] != before.get(stage, (0,))[0]}, elapsed
+
+
+def wait_for_warm_up():
+    # The user looks at the form for a while before the first click
+    for thread in threading.enumerate():
+        if thread.name == 'agemates-warm':
+            thread.join()
+
+
+def main():
+    failures = []
+
+    def expect(name, ran, elapsed, required, forbidden):
+        print(f'{name:28} {elapsed:8.1f} ms  {", ".join(sorted(ran))}')
+        if not required <= ran or ran & forbidden:
+            failures.append(f'{name}: ran {sorted(ran)}, expected {sorted(required)} and none of {sorted(forbidden)}')
+
+    with FragmentReruns() as reruns:
+        at = AppTest.from_file(os.path.join(ROOT, 'age-mates.py'), default_timeout=120)
+        ran, elapsed = stages_of(at.run)
+        expect('first load (full run)', ran, elapsed, {'page', 'inputs'}, {'story', 'load'})
+        if len(reruns.known) != 1:
+            sys.exit(f'expected one fragment, found {len(reruns.known)}')
+        wait_for_warm_up()
+
+        # From now on only the fragment reruns, as for interactions in the browser
+        reruns.fragment_ids = list(reruns.known)
+        interactions = [
+            ('change year', lambda: at.number_input[0].set_value(1990).run(), {'inputs'}, {'page', 'load', 'story'}),
+            ('change country', lambda: at.selectbox[0].set_value('Hungary').run(), {'inputs'}, {'page', 'load', 'story'}),
+            ('change gender', lambda: at.radio[0].set_value('Female').run(), {'inputs'}, {'page', 'load', 'story'}),
+            ('create story', lambda: at.button[0].click().run(), {'inputs', 'story', 'html'} | BUILD_STAGES, {'page', 'load'}),
+            ('create story again (cached)', lambda: at.button[0].click().run(), {'story', 'html'}, {'page', 'load'} | BUILD_STAGES),
+            ('change year after story', lambda: at.number_input[0].set_value(1991).run(), {'inputs'}, {'page', 'story'}),
+        ]
+        for name, interaction, required, forbidden in interactions:
+            ran, elapsed = stages_of(interaction)
+            expect(name, ran, elapsed, required, forbidden)
+
+    for failure in failures:
+        print('FAIL', failure)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,274 @@
+"""Load test: N concurrent sessions against one local Streamlit server running age-mates.py.
+
+Starts ``streamlit run age-mates.py`` (or uses ``--url``) and connects N
+simulated browsers to its websocket. Every session speaks the browser's
+protocol: it sends the widget states with every rerun request, reruns the
+story form fragment for widgets inside it, and reads the server's messages up
+to the end of the run. Each session replays an interaction script: load the
+page, then per round change the year, pick a country, toggle the gender and
+click "Create Story". Selections come from a pool of ``--pool`` random ones,
+so sessions share some stories, as real users do.
+
+Reported: p50/p95/p99 latency per action, "Create Story" throughput, the bytes
+the server sent per session and the server's RSS (peak and at the end).
+
+    python benchmarks/load_test.py --sessions 8 --rounds 3
+    python benchmarks/load_test.py --saturate --slo-ms 1000
+
+``--saturate`` doubles the sessions from 1 until the p95 "Create Story"
+latency breaks ``--slo-ms`` and reports the last level that met it. Streamlit's
+AppTest cannot drive this: it swaps process globals on every run, so
+concurrent AppTests interfere with each other.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from streamlit.proto.BackMsg_pb2 import BackMsg  # noqa: E402
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg  # noqa: E402
+from tornado.websocket import websocket_connect  # noqa: E402
+
+from agemates.schema import load_schema  # noqa: E402
+
+APP = os.path.join(ROOT, 'age-mates.py')
+
+ACTIONS = ['load', 'year', 'country', 'gender', 'create']
+
+# Seconds between two RSS samples of the server
+RSS_INTERVAL = 0.05
+
+
+def selection_pool(size, seed):
+    schema = load_schema()
+    rng = random.Random(seed)
+    years, countries = list(schema.years()), schema.country_names()
+    return [(rng.choice(years), rng.choice(countries)) for _ in range(size)]
+
+
+def rss_mb(pid):
+    """Return the RSS of process ``pid`` in MB, None where /proc is not available."""
+    try:
+        with open(f'/proc/{pid}/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except OSError:
+        return None
+
+
+def start_server(cwd=ROOT):
+    """Start ``streamlit run age-mates.py`` in ``cwd`` on a free port and return (process, url) once it is healthy."""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'streamlit', 'run', APP, '--server.headless', 'true', '--server.port', str(port),
+         '--server.address', '127.0.0.1', '--browser.gatherUsageStats', 'false'],
+        cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(url + '/_stcore/health', timeout=1):
+                return process, url
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError('the Streamlit server did not start')
+
+
+class Session:
+    """One simulated browser session: its widget states and the latency of every rerun it triggered."""
+
+    def __init__(self, url, pool, rounds, seed):
+        self.url = url.replace('http', 'ws', 1).rstrip('/') + '/_stcore/stream'
+        self.pool = pool
+        self.rounds = rounds
+        self.rng = random.Random(seed)
+        self.latencies = {action: [] for action in ACTIONS}
+        self.bytes = 0
+        self.page_script_hash = ''
+        # Widget label -> element proto, and the widget states sent with every rerun
+        self.widgets = {}
+        self.fragments = {}
+        self.states = {}
+
+    def _element(self, delta):
+        element = delta.new_element
+        kind = element.WhichOneof('type')
+        if kind == 'exception':
+            raise RuntimeError(f'{element.exception.type}: {element.exception.message}')
+        if kind in ('number_input', 'selectbox', 'radio', 'button'):
+            widget = getattr(element, kind)
+            self.widgets[kind] = widget
+            self.fragments[widget.id] = delta.fragment_id
+
+    async def _rerun(self, action, connection, widget=None, trigger=False):
+        message = BackMsg()
+        rerun = message.rerun_script
+        rerun.query_string = ''
+        rerun.page_script_hash = self.page_script_hash
+        for widget_id, (field, value) in self.states.items():
+            state = rerun.widget_states.widgets.add(id=widget_id)
+            setattr(state, field, value)
+        if widget is not None:
+            # Like the browser: a widget inside a fragment only reruns the fragment
+            rerun.fragment_id = self.fragments.get(widget.id, '')
+            if trigger:
+                rerun.widget_states.widgets.add(id=widget.id, trigger_value=True)
+
+        start = time.perf_counter()
+        await connection.write_message(message.SerializeToString(), binary=True)
+        while True:
+            data = await connection.read_message()
+            if data is None:
+                raise RuntimeError('the server closed the connection')
+            self.bytes += len(data)
+            forward = ForwardMsg()
+            forward.ParseFromString(data)
+            kind = forward.WhichOneof('type')
+            if kind == 'new_session':
+                self.page_script_hash = forward.new_session.page_script_hash
+            elif kind == 'delta' and forward.delta.WhichOneof('type') == 'new_element':
+                self._element(forward.delta)
+            elif kind == 'script_finished':
+                if forward.script_finished == ForwardMsg.FINISHED_WITH_COMPILE_ERROR:
+                    raise RuntimeError('the app failed to compile')
+                break
+        self.latencies[action].append((time.perf_counter() - start) * 1e3)
+
+    def _set(self, kind, field, value):
+        widget = self.widgets[kind]
+        self.states[widget.id] = (field, value)
+        return widget
+
+    async def run(self):
+        connection = await websocket_connect(self.url, max_message_size=64 * 2**20)
+        try:
+            await self._rerun('load', connection)
+            for _ in range(self.rounds):
+                year, country = self.rng.choice(self.pool)
+                await self._rerun('year', connection, self._set('number_input', 'int_value', year))
+                selectbox = self.widgets['selectbox']
+                await self._rerun('country', connection, self._set('selectbox', 'int_value', list(selectbox.options).index(country)))
+                radio = self.widgets['radio']
+                current = self.states.get(radio.id, ('int_value', radio.default))[1]
+                await self._rerun('gender', connection, self._set('radio', 'int_value', 1 - current))
+                await self._rerun('create', connection, self.widgets['button'], trigger=True)
+        finally:
+            connection.close()
+        return self
+
+
+def percentiles(samples):
+    if len(samples) < 2:
+        return {'p50': samples[0], 'p95': samples[0], 'p99': samples[0]} if samples else {}
+    quantiles = statistics.quantiles(samples, n=100, method='inclusive')
+    return {'p50': quantiles[49], 'p95': quantiles[94], 'p99': quantiles[98]}
+
+
+async def run_level(url, pid, sessions, rounds, pool, seed):
+    """Run ``sessions`` concurrent sessions and return their statistics."""
+    rss_start = rss_mb(pid) if pid else None
+    rss_peak = rss_start
+    running = asyncio.gather(*(Session(url, pool, rounds, seed + i).run() for i in range(sessions)))
+    start = time.perf_counter()
+    while not running.done():
+        await asyncio.wait([running], timeout=RSS_INTERVAL)
+        if pid and rss_start is not None:
+            rss_peak = max(rss_peak, rss_mb(pid))
+    done = running.result()
+    elapsed = time.perf_counter() - start
+
+    latencies = {action: percentiles([ms for session in done for ms in session.latencies[action]])
+                 for action in ACTIONS}
+    creates = sum(len(session.latencies['create']) for session in done)
+    return {
+        'sessions': sessions,
+        'seconds': elapsed,
+        'latency_ms': latencies,
+        'creates_per_second': creates / elapsed,
+        'reruns_per_second': sum(len(values) for session in done for values in session.latencies.values()) / elapsed,
+        'bytes_per_session': statistics.mean(session.bytes for session in done),
+        'rss_mb': {'start': rss_start, 'peak': rss_peak, 'end': rss_mb(pid) if pid else None},
+    }
+
+
+def report(result):
+    rss = result['rss_mb']
+    memory = f'RSS {rss["start"]:.0f} -> {rss["peak"]:.0f} MB peak, {rss["end"]:.0f} MB end' if rss['start'] else 'RSS n/a'
+    print(f'{result["sessions"]} sessions in {result["seconds"]:.1f} s: '
+          f'{result["creates_per_second"]:.1f} stories/s, {result["reruns_per_second"]:.1f} reruns/s, '
+          f'{result["bytes_per_session"] / 1e3:.0f} KB/session, {memory}')
+    for action, stats in result['latency_ms'].items():
+        print(f'  {action:8} p50 {stats["p50"]:8.1f} ms  p95 {stats["p95"]:8.1f} ms  p99 {stats["p99"]:8.1f} ms')
+
+
+async def load_test(args, url, pid):
+    pool = selection_pool(args.pool, args.seed)
+    # The first session pays for the imports and the shared dataset structures of the server
+    await Session(url, pool, 0, args.seed).run()
+
+    results = []
+    levels = [args.sessions]
+    if args.saturate:
+        levels = [2 ** exponent for exponent in range(args.max_sessions.bit_length())]
+    for level, sessions in enumerate(levels):
+        # A new seed per level, so that a level does not only replay the stories cached by the previous one
+        result = await run_level(url, pid, sessions, args.rounds, pool, args.seed + level * args.max_sessions)
+        report(result)
+        results.append(result)
+        if args.saturate and result['latency_ms']['create']['p95'] > args.slo_ms:
+            break
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sessions', type=int, default=8, help='concurrent sessions (default: %(default)s)')
+    parser.add_argument('--rounds', type=int, default=3, help='interaction rounds per session (default: %(default)s)')
+    parser.add_argument('--pool', type=int, default=100, help='distinct year/country selections (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--url', help='test a running server instead of starting one')
+    parser.add_argument('--pid', type=int, help='process id of the --url server, for its RSS')
+    parser.add_argument('--saturate', action='store_true', help='double the sessions until the SLO breaks')
+    parser.add_argument('--slo-ms', type=float, default=1000, help='p95 "Create Story" latency SLO (default: %(default)s)')
+    parser.add_argument('--max-sessions', type=int, default=256, help='upper bound of --saturate (default: %(default)s)')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    args = parser.parse_args(argv)
+
+    server = None
+    url, pid = args.url, args.pid
+    if url is None:
+        server, url = start_server()
+        pid = server.pid
+    try:
+        results = asyncio.run(load_test(args, url, pid))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    if args.saturate:
+        met = [result['sessions'] for result in results if result['latency_ms']['create']['p95'] <= args.slo_ms]
+        if met:
+            print(f'SLO p95 "Create Story" <= {args.slo_ms:.0f} ms held up to {max(met)} concurrent sessions')
+        else:
+            print(f'SLO p95 "Create Story" <= {args.slo_ms:.0f} ms broken with a single session')
+    if args.output:
+        with open(args.output, 'w', encoding='utf8') as file:
+            json.dump({'slo_ms': args.slo_ms, 'levels': results}, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,10 @@
+"""Headless story API next to the Streamlit app (see agemates.api).
+
+    uvicorn story_api:app --workers 4
+
+GET /story?year=1980&country=Hungary&gender=Female[&format=json]
+"""
+from agemates.api import create_app
+
+# Stories are built from the data.csv next to this file, like in age-mates.py
+app = create_app()